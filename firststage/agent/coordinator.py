@@ -3,19 +3,29 @@
 # REQUEST.ASK_EXPERT (+history) -> RESULT -> PRESENTER_REPLY
 # Dodatki: logging do KB (frame + timeline), historia do AI i do specjalisty.
 # ZMIANY (2025-11-10):
-# - ACK dla STORE (frame + timeline) – oczekiwanie na INFORM {type:"STORED"}
-# - Retry/backoff (exponential + jitter) dla GET/STORE wobec KB
-# - Automatyczny read-modify-write przy FAILURE.CONFLICT na timeline (if_match)
+# - Zapis do KB jednym APPEND (frame + timeline w jednej transakcji) – ACK: INFORM {type:"APPENDED"}
+# - Retry/backoff (exponential + jitter) dla GET/APPEND wobec KB
+# - Lokalna (autorytatywna) kopia timeline (LRU, deque) – GET do KB tylko przy zimnym starcie,
+#   zapis APPEND w tle (Koordynator jest jedynym piszącym)
 # - Telemetria KB: czasy i liczniki (best-effort, z adapterem metryk)
 # - [PUNKT 8] Spójność sesji + korelacja: CorrBook + allow_if_correlated
 # - [PUNKT 8] Rejestr oczekiwań pod DF (QUERY-REF→INFORM) i Specjalistę (REQUEST→AGREE/INFORM)
+# - Odpowiedzi DF/Specjalisty trafiają do Future po in_reply_to (bez odpytywania kolejki co 1 s)
 
 import os
+import sys
+import queue
+import atexit
 import json
 import time
+import logging
+from logging.handlers import QueueHandler, QueueListener
 import asyncio
 import random
-from typing import Dict, Any, Optional, List, Tuple
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Any, Optional, List, Set, Tuple
 
 # --- dotenv (opcjonalnie) ---
 try:
@@ -31,14 +41,29 @@ except Exception as e:
 # --- SPADE ---
 from spade.agent import Agent
 from spade.message import Message
-from spade.behaviour import CyclicBehaviour, OneShotBehaviour
+from slixmpp import JID
+from spade.behaviour import CyclicBehaviour
 
 # --- AI Connector ---
 from firststage.utils.aiconnector import AIConnector  # ścieżka zgodna z drzewem projektu
+from firststage.utils.limiter import AdaptiveLimiter
 
 # --- PROTOKOŁ i KORELACJA (punkt 8) ---
-from firststage.protocol.acl_messages import AclMessage, make_acl, new_reply_id, now_iso  # wzorcowe DTO/FIPA
-from firststage.protocol.correlation import CorrBook
+from firststage.protocol.acl_messages import (  # wzorcowe DTO/FIPA
+    AclMessage, AclTemplate, new_reply_id, now_iso, now_ms,
+)
+from firststage.protocol import codec  # orjson (jeśli dostępny) zamiast stdlib json na gorącej ścieżce
+from firststage.protocol.kb_messages import KBReply, decode_kb_reply
+from firststage.protocol.fastpath import (  # czyste helpery gorącej ścieżki (opcjonalnie mypyc)
+    compact as _compact,
+    dig as _dig,
+    history_text_from_acl as _history_text_from_acl,
+    is_presenter_reply,
+    looks_like_json_object,
+    normalize_candidates,
+    short as _short,
+)
+from firststage.protocol.correlation import ACK_PFS, CorrBook
 from firststage.protocol.guards import allow_if_correlated, bare as bare_jid
 
 # --- Metryki (best-effort adapter wspólnego modułu) ---
@@ -77,6 +102,27 @@ except Exception:
         "{ \"selected_jid\": \"...\", \"reason\": \"...\", \"confidence\": 0..1 }"
     )
 
+# Stały prefiks żądania do selektora: ten sam obiekt przy każdym wywołaniu (zmienia się tylko wiadomość user),
+# więc prompt caching po stronie OpenAI (automatyczny dla identycznego prefiksu) może go ponownie użyć.
+_SYS_MSG: Dict[str, str] = {"role": "system", "content": SELECTOR_SYSTEM_PROMPT or ""}
+# Wariant wsadowy: kilka rozmów w jednym wywołaniu (response_format=json_object → tablica opakowana w obiekt)
+_SYS_BATCH_MSG: Dict[str, str] = {"role": "system", "content": (SELECTOR_SYSTEM_PROMPT or "") + (
+    "\n\nTRYB WSADOWY: wejście to {\"requests\": [...]} – każdy element to osobne, niezależne zapytanie "
+    "(własny conversation_id, kandydaci i historia). Dla KAŻDEGO elementu wybierz kandydata wyłącznie z jego listy. "
+    "Zwróć JSON: { \"selections\": [ { \"conversation_id\": \"...\", \"selected_jid\": \"...\", "
+    "\"reason\": \"...\", \"confidence\": 0..1 }, ... ] }"
+)}
+_SYS_PROMPT_PREVIEW = (SELECTOR_SYSTEM_PROMPT or "")[:240] + (
+    "..." if (SELECTOR_SYSTEM_PROMPT and len(SELECTOR_SYSTEM_PROMPT) > 240) else "")
+
+# Stałe Dyspozytora (internowane: porównanie z tym samym obiektem kończy się na teście tożsamości).
+# Wartości z sieci porównujemy zawsze przez == (orjson nie internuje wartości).
+_K_PF = sys.intern("performative")
+_K_CONTENT = sys.intern("content")
+_K_TYPE = sys.intern("type")
+_PF_REQUEST = sys.intern("REQUEST")
+_T_USER_MSG = sys.intern("USER_MSG")
+
 # ====== ENV ======
 def _env(*names: str, default: Optional[str] = None) -> Optional[str]:
     for n in names:
@@ -85,36 +131,118 @@ def _env(*names: str, default: Optional[str] = None) -> Optional[str]:
             return v
     return default
 
+def _env_int(name: str, default: int) -> int:
+    """Liczba z ENV; brak/pusta wartość → default. Błędny format → ValueError przy starcie (nie po cichu)."""
+    v = (os.environ.get(name) or "").strip()
+    return int(v) if v else default
+
+def _env_float(name: str, default: float) -> float:
+    v = (os.environ.get(name) or "").strip()
+    return float(v) if v else default
+
 AGENT_JID        = _env("COORDINATOR_JID", "AGENT_JID", "XMPP_JID")
 AGENT_PASS       = _env("COORDINATOR_PASS", "AGENT_PASS", "XMPP_PASS")
 REGISTRY_JID     = _env("REGISTRY_JID", "DF_JID", default="registry@xmpp.pawelhaladyj.pl")
 
 NEED_CAP         = _env("NEED_CAP", default="ASK_EXPERT") or "ASK_EXPERT"
-REQ_TIMEOUT_S    = int(_env("COORD_REQ_TIMEOUT", default="10") or "10")
-MAX_RETRIES      = int(_env("COORD_MAX_RETRIES", default="2") or "2")
-MAX_CONCURRENCY  = int(_env("COORD_MAX_CONCURRENCY", default="5") or "5")
-CONV_GRACE_SEC   = float(_env("COORD_CONV_GRACE_SEC", default="0.5") or "0.5")
+REQ_TIMEOUT_S    = _env_int("COORD_REQ_TIMEOUT", 10)
+MAX_RETRIES      = _env_int("COORD_MAX_RETRIES", 2)
+MAX_CONCURRENCY  = _env_int("COORD_MAX_CONCURRENCY", 5)  # startowy limit rozmów (AIMD: rośnie/maleje w locie)
+MAX_CONCURRENCY_CAP = _env_int("COORD_MAX_CONCURRENCY_MAX", 4 * MAX_CONCURRENCY)
+BG_TASKS_MAX     = _env_int("COORD_BG_TASKS_MAX", 256)  # limit zapisów KB w tle (backpressure)
+RECV_TIMEOUT_S   = _env_float("COORD_RECV_TIMEOUT", 30.0)  # Dispatcher: czekanie na ramkę (bez odpytywania co 1 s)
+MAX_PENDING_CONVS = _env_int("COORD_MAX_PENDING_CONVS", 2 * MAX_CONCURRENCY_CAP)  # kolejka rozmów do workerów
+CONV_GRACE_SEC   = _env_float("COORD_CONV_GRACE_SEC", 0.5)
 DF_MODE          = (_env("COORD_DF_MODE", default="NEED") or "NEED").upper()  # NEED | ALL
-DEBUG_AI         = (_env("COORD_DEBUG_AI", default="1") or "1") == "1"
+DEBUG_AI         = (_env("COORD_DEBUG_AI", default="0") or "0") == "1"  # 1 = zrzut payloadu/odpowiedzi selektora (DEBUG)
+AI_HISTORY_MAX   = _env_int("COORD_AI_HISTORY", 6)        # ile ostatnich wpisów historii do selektora
+AI_TEXT_MAX      = _env_int("COORD_AI_TEXT_MAX", 280)   # przycięcie tekstu wpisu/opisu (znaki)
+AI_BATCH_MAX     = _env_int("COORD_AI_BATCH_MAX", 1)     # ile zapytań selektora w jednym wywołaniu (1 = bez wsadów; >1 opt-in)
+AI_BATCH_WINDOW_S = _env_int("COORD_AI_BATCH_WINDOW_MS", 20) / 1000.0  # okno zbierania wsadu
+HEDGE_DELAY_S    = _env_int("COORD_HEDGE_DELAY_MS", 0) / 1000.0  # >0: po tylu ms ciszy pytamy też kolejnego (opt-in); 0 = szeregowo
+ASK_RACE         = (_env("COORD_ASK_RACE", default="0") or "0") == "1"  # 1 = pytaj wszystkich MAX_RETRIES kandydatów naraz
+DF_TTL_S         = _env_float("COORD_DF_TTL", 60.0)  # s; cache kandydatów z DF (0 = zawsze pytaj DF)
+SELECT_CACHE_TTL = _env_float("COORD_SELECT_CACHE_TTL", 60.0)  # s; wybór AI dla (NEED, kandydaci, domain_tags); 0 = wył.
+SELECT_CACHE_MAX = _env_int("COORD_SELECT_CACHE_MAX", 1024)
+AI_SKILLS_MAX    = _env_int("COORD_AI_SKILLS_MAX", 8)    # ile pierwszych skills kandydata do selektora (0 = bez skills)
+DEBUG_DISPATCH   = (_env("COORD_DEBUG_DISPATCH", default="0") or "0") == "1"
 
 # --- KB integracja ---
 KB_JID           = _env("KB_JID", default="kb@xmpp.pawelhaladyj.pl")
-HISTORY_LEN      = int(_env("COORD_HISTORY_LEN", default="10") or "10")
-KB_TIMEOUT_S     = int(_env("COORD_KB_TIMEOUT", default="5") or "5")
+HISTORY_LEN      = _env_int("COORD_HISTORY_LEN", 10)
+KB_TIMEOUT_S     = _env_int("COORD_KB_TIMEOUT", 5)
 KB_LOG_VERBOSE   = (_env("COORD_KB_LOG", default="1") or "1") == "1"
+TL_CACHE_MAX     = _env_int("COORD_TL_CACHE_MAX", 256)  # ile rozmów trzymamy w cache timeline
+KB_ENCODING      = (_env("COORD_KB_ENCODING", default=codec.ENC_JSON) or codec.ENC_JSON).lower()  # json | mp+b64
+if KB_ENCODING == codec.ENC_MSGPACK_B64 and not codec.msgpack_available():
+    print("[COORD] Uwaga: COORD_KB_ENCODING=mp+b64 wymaga 'msgspec' – używam JSON.")
+    KB_ENCODING = codec.ENC_JSON
+elif KB_ENCODING not in (codec.ENC_JSON, codec.ENC_MSGPACK_B64):
+    print(f"[COORD] Uwaga: nieznane COORD_KB_ENCODING={KB_ENCODING!r} – używam JSON.")
+    KB_ENCODING = codec.ENC_JSON
 
 # --- Retry/backoff dla KB ---
-KB_MAX_TRIES     = int(_env("COORD_KB_MAX_TRIES", default="3") or "3")
-KB_BACKOFF_BASE  = float(_env("COORD_KB_BACKOFF_BASE", default="0.2") or "0.2")
-KB_BACKOFF_MAX   = float(_env("COORD_KB_BACKOFF_MAX", default="1.2") or "1.2")
+KB_MAX_TRIES     = _env_int("COORD_KB_MAX_TRIES", 3)
+KB_BACKOFF_BASE  = _env_float("COORD_KB_BACKOFF_BASE", 0.2)
+KB_BACKOFF_MAX   = _env_float("COORD_KB_BACKOFF_MAX", 1.2)
 
 # ====== helpers ======
-def now_ms() -> int:
-    return int(time.time() * 1000)
-
-def _short(txt: str, n: int = 80) -> str:
-    t = (txt or "").replace("\n", " ").strip()
-    return t if len(t) <= n else (t[:n] + "…")
+LOG_LEVEL        = (_env("COORD_LOG_LEVEL", default="INFO") or "INFO").upper()
+
+_LOG_TAGS = {"coord.kb": "[COORD][KB]", "ai": "[AI]"}
+
+
+class _CoordFormatter(logging.Formatter):
+    """Format logów jak dawne print(): "[COORD] 2025-01-01T12:00:00Z ..." ([COORD][KB] dla coord.kb, [AI] dla ai)."""
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.tag = _LOG_TAGS.get(record.name, "[COORD]")
+        return super().format(record)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler.prepare() domyślnie formatuje cały rekord (wraz z traceback) w wątku wołającym (tu: pętla zdarzeń).
+    Tu tylko msg % args na pętli – argumenty (listy kandydatów, historia) pętla dalej modyfikuje, więc wątek
+    QueueListener nie może ich czytać później. Znacznik czasu, tag i traceback składa już wątek QueueListener.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _setup_logging() -> logging.Logger:
+    """Logger "coord": na pętli tylko put do kolejki; formatowanie i zapis na stdout w wątku QueueListener."""
+    root = logging.getLogger("coord")
+    if not root.handlers:
+        q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        out = logging.StreamHandler(sys.stdout)
+        out.setFormatter(_CoordFormatter("%(tag)s %(asctime)s %(message)s", datefmt="%Y-%m-%dT%H:%M:%SZ"))
+        listener = QueueListener(q, out)
+        listener.start()
+        atexit.register(listener.stop)  # dopisz zaległe rekordy przy wyjściu
+        root.addHandler(_DeferredQueueHandler(q))
+        root.propagate = False
+        # AIConnector loguje na "ai" – ta sama kolejka, żeby wywołania AI nie pisały na stdout z pętli
+        ai = logging.getLogger("ai")
+        ai.handlers[:] = [_DeferredQueueHandler(q)]
+        ai.propagate = False
+    root.setLevel(LOG_LEVEL)
+    return root
+
+
+def _debug_logger(name: str, enabled: bool) -> logging.Logger:
+    """Logger DEBUG (dziecko "coord"); gdy wyłączony – log.debug() nic nie formatuje."""
+    log = logging.getLogger(name)
+    log.setLevel(logging.DEBUG if enabled else logging.NOTSET)
+    return log
+
+log = _setup_logging()
+log_kb = logging.getLogger("coord.kb")
+log_ai = _debug_logger("coord.ai", DEBUG_AI)
+log_dispatch = _debug_logger("coord.dispatch", DEBUG_DISPATCH)
 
 def _exp_backoff_sleep(attempt: int) -> float:
     expo = KB_BACKOFF_BASE * (2 ** max(0, attempt - 1))
@@ -126,32 +254,160 @@ def parse_acl_to_dict(body: str) -> Dict[str, Any]:
     try:
         return AclMessage.loads(body).model_dump()
     except Exception:
-        return json.loads(body or "{}")
-
-def _history_text_from_acl(acl: Dict[str, Any]) -> str:
-    c = (acl.get("content") or {})
-    typ = str(c.get("type") or "").upper()
-    if typ == "USER_MSG":
-        return str((c.get("args") or {}).get("question") or "")
-    if typ == "PRESENTER_REPLY":
-        return str(c.get("text") or "")
-    if typ == "RESULT":
-        r = (c.get("result") or {})
-        return str(r.get("answer") or c.get("answer") or "")
-    return ""
+        return codec.loads(body or "{}")
+
+# Szablony ramek wychodzących: walidacja AclMessage raz przy imporcie, przy wysyłce tylko kopia + dumps
+_DF_QUERY_TPL = AclTemplate("QUERY-REF", "Coordinator", "Registry", protocol="fipa-query")
+_SPEC_REQUEST_TPL = AclTemplate("REQUEST", "Coordinator", "Specialist")
+_PRESENTER_REPLY_TPL = AclTemplate("INFORM", "Coordinator", "Presenter")
+
+@functools.lru_cache(maxsize=1024)
+def _jid(addr: str) -> JID:
+    """JID odbiorcy parsowany raz na adres; Message tylko go czyta, więc obiekt może być współdzielony."""
+    return JID(addr)
+
+def build_msg(to: str, pf: str, conv: str, body: str, reply_with: Optional[str] = None,
+              in_reply_to: Optional[str] = None) -> Message:
+    """
+    Wiadomość wychodząca z metadanymi w jednym słowniku: bez serii set_metadata()
+    (każde wywołanie sprawdza typy); wartości tu są zawsze str.
+    """
+    msg = Message(to=_jid(to), body=body)
+    meta = {"conv": conv, "performative": pf}
+    if reply_with:
+        meta["reply_with"] = reply_with
+    if in_reply_to:
+        meta["in_reply_to"] = in_reply_to
+    msg.metadata = meta
+    return msg
+
+def parse_msg_to_dict(msg: Message) -> Dict[str, Any]:
+    """Parsowanie body z uwzględnieniem metadanej 'encoding' (MessagePack od KB, JSON od pozostałych)."""
+    enc = msg.get_metadata(codec.ENCODING_META)
+    if enc == codec.ENC_MSGPACK_B64:
+        return codec.decode_body(msg.body or "", enc)
+    return parse_acl_to_dict(msg.body)
+
+def _timeline_head(acl: Dict[str, Any]) -> Dict[str, Any]:
+    """Pola wpisu timeline z ramki ACL (bez ts)."""
+    return {
+        "agent": str(acl.get("sender") or "").strip() or "Unknown",
+        "pf": str(acl.get("performative") or ""),
+        "type": str(_dig(acl, "content", "type") or ""),
+        "text": _history_text_from_acl(acl),
+    }
+
+class AIBatcher:
+    """
+    Łączy zapytania selektora z krótkiego okna (AI_BATCH_WINDOW_S, max AI_BATCH_MAX) w jedno wywołanie chat.
+    submit() zwraca wynik w kształcie achat_from_history ({"text": ...} albo {"error": ...}) dla JEDNEJ rozmowy,
+    więc weryfikacja wyboru po stronie rozmowy zostaje bez zmian. Wsad z jednym zapytaniem = zwykły prompt.
+    Domyślnie wyłączony (AI_BATCH_MAX=1): każde zapytanie od razu, bez okna i bez promptu wsadowego.
+    """
+
+    def __init__(self, ai: AIConnector, window_s: float, batch_max: int):
+        self.ai = ai
+        self.window_s = max(0.0, window_s)
+        self.batch_max = max(1, batch_max)
+        self._pending: List[Tuple[asyncio.Future, Dict[str, Any]]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, selector_input: Dict[str, Any]) -> Dict[str, Any]:
+        if self.batch_max <= 1:
+            return await self._call_one(selector_input)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((fut, selector_input))
+        if len(self._pending) >= self.batch_max:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _call_one(self, selector_input: Dict[str, Any]) -> Dict[str, Any]:
+        messages = [_SYS_MSG, {"role": "user", "content": codec.dumps(selector_input)}]
+        return await self.ai.achat_from_history(
+            messages, caller="Coordinator", extra={"response_format": {"type": "json_object"}}
+        )
+
+    async def _run(self, batch: List[Tuple[asyncio.Future, Dict[str, Any]]]) -> None:
+        try:
+            if len(batch) == 1:
+                fut, inp = batch[0]
+                res = await self._call_one(inp)
+                if not fut.done():
+                    fut.set_result(res)
+                return
+            messages = [_SYS_BATCH_MSG, {"role": "user", "content": codec.dumps({"requests": [i for _, i in batch]})}]
+            log.info("[AI] wsad selektora: %s rozmów w jednym wywołaniu", len(batch))
+            res = await self.ai.achat_from_history(
+                messages, caller="Coordinator", extra={"response_format": {"type": "json_object"}}
+            )
+            if res.get("error"):
+                for fut, _ in batch:
+                    if not fut.done():
+                        fut.set_result(res)
+                return
+            txt = (res.get("text") or "").strip()
+            try:
+                data = codec.loads(txt) if txt else {}
+                sels = data.get("selections") if isinstance(data, dict) else None
+            except ValueError:
+                sels = None
+            by_conv: Dict[str, Any] = {}
+            for sel in sels or []:
+                if isinstance(sel, dict) and sel.get("conversation_id"):
+                    by_conv[str(sel["conversation_id"])] = sel
+            for fut, inp in batch:
+                if fut.done():
+                    continue
+                sel = by_conv.get(str(inp.get("conversation_id")))
+                if sel is not None:
+                    fut.set_result({"text": codec.dumps(sel)})
+                else:
+                    fut.set_result({"error": {"type": "batch_missing", "raw": _short(txt, 200)}})
+        except Exception as e:
+            for fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+
 
 # ====== AGENT ======
 class CoordinatorAgent(Agent):
     def __init__(self, jid: str, password: str, *args, **kwargs):
         super().__init__(jid, password, *args, **kwargs)
-        self.conv_queues: Dict[str, asyncio.Queue] = {}
-        self.sem = asyncio.Semaphore(MAX_CONCURRENCY)
+        # rozmowy w toku (przyjęte do work_q, przed sprzątaniem) – ponowny USER_MSG nie otwiera drugiej
+        self.live_convs: Set[str] = set()
+        # oczekiwane odpowiedzi: reply_with -> Future[(acl, następny Future | None)]
+        self.pending: Dict[str, asyncio.Future] = {}
+        # odpowiedzi KB: kb_conv -> Future[KBReply] (routing po nadawcy + conversation_id)
+        self.kb_pending: Dict[str, asyncio.Future] = {}
+        # limit rozmów: maleje przy przeciążeniu AI (429) / timeout specjalisty, rośnie przy sukcesach
+        self.limiter = AdaptiveLimiter(MAX_CONCURRENCY, min_limit=1, max_limit=MAX_CONCURRENCY_CAP)
+        # nowe rozmowy (USER_MSG) → stała pula Workerów; pełna kolejka = odmowa zamiast nieograniczonych behawiorów
+        self.work_q: asyncio.Queue = asyncio.Queue(maxsize=max(1, MAX_PENDING_CONVS))
         self.registry_jid = REGISTRY_JID
         self.kb_jid = KB_JID
+        self.kb_bare = bare_jid(KB_JID)
         self.history_len = HISTORY_LEN
         self.kb_timeout = KB_TIMEOUT_S
         self.kb_log = KB_LOG_VERBOSE
-        self.ai = AIConnector()
+        # AI: natywnie async (AsyncOpenAI, pula keep-alive); pula wątków tylko dla OPENAI_NATIVE_ASYNC=0
+        self.ai_executor = ThreadPoolExecutor(max_workers=max(1, 2 * MAX_CONCURRENCY_CAP), thread_name_prefix="ai")
+        self.ai = AIConnector(executor=self.ai_executor, max_connections=MAX_CONCURRENCY_CAP)
+        self.ai_batcher = AIBatcher(self.ai, AI_BATCH_WINDOW_S, AI_BATCH_MAX)
         # korelacja (punkt 8)
         self.corr = CorrBook(ttl_sec=REQ_TIMEOUT_S + 2.0)
         # liczniki (lokalne)
@@ -160,77 +416,269 @@ class CoordinatorAgent(Agent):
         self.kb_store_timeout = 0
         self.kb_get_ok = 0
         self.kb_get_timeout = 0
+        # timeline: conv_id -> (wpisy, wersja w KB); Koordynator jest jedynym piszącym, więc ta kopia
+        # jest autorytatywna. LRU ograniczone TL_CACHE_MAX (wyrzucona rozmowa → ponowny GET przy zimnym starcie).
+        self.timeline: "OrderedDict[str, Tuple[Deque[Dict[str, Any]], Optional[int]]]" = OrderedDict()
+        # zadania w tle (APPEND do KB) – trzymamy referencje, żeby GC ich nie zebrał
+        self._bg_tasks: set = set()
+        # cache kandydatów z DF: "tryb:NEED" -> ((lista, nagłówek INFORM), znacznik monotonic)
+        # + zapytania w toku (single-flight)
+        self._df_cache: Dict[str, Tuple[Tuple[List[Any], Dict[str, Any]], float]] = {}
+        self.df_inflight: Dict[str, asyncio.Future] = {}
+        # cache wyborów selektora: (NEED, jidy kandydatów, domain_tags) -> (jid, znacznik monotonic)
+        self._sel_cache: Dict[Tuple[Any, ...], Tuple[str, float]] = {}
+
+    def df_cache_get(self, key: str) -> Optional[Tuple[List[Any], Dict[str, Any]]]:
+        hit = self._df_cache.get(key)
+        if hit is None or time.monotonic() - hit[1] >= DF_TTL_S:
+            return None
+        return hit[0]
+
+    def df_cache_put(self, key: str, result: Tuple[List[Any], Dict[str, Any]]) -> None:
+        if DF_TTL_S > 0:
+            self._df_cache[key] = (result, time.monotonic())
+
+    def sel_cache_get(self, key: Tuple[Any, ...]) -> Optional[str]:
+        hit = self._sel_cache.get(key)
+        if hit is None:
+            return None
+        if time.monotonic() - hit[1] > SELECT_CACHE_TTL:
+            self._sel_cache.pop(key, None)
+            return None
+        return hit[0]
+
+    def sel_cache_put(self, key: Tuple[Any, ...], jid: str) -> None:
+        now = time.monotonic()
+        if len(self._sel_cache) >= SELECT_CACHE_MAX:
+            # sprzątanie przy zapisie: wygasłe, a gdy nadal pełno – najstarsze wstawione
+            self._sel_cache = {k: v for k, v in self._sel_cache.items() if now - v[1] <= SELECT_CACHE_TTL}
+            while len(self._sel_cache) >= SELECT_CACHE_MAX:
+                self._sel_cache.pop(next(iter(self._sel_cache)))
+        self._sel_cache[key] = (jid, now)
+
+    def timeline_get(self, conv_id: str) -> Optional[Tuple[Deque[Dict[str, Any]], Optional[int]]]:
+        entry = self.timeline.get(conv_id)
+        if entry is not None:
+            self.timeline.move_to_end(conv_id)
+        return entry
+
+    def timeline_seed(self, conv_id: str, entries: List[Dict[str, Any]], version: Optional[int]) -> Deque[Dict[str, Any]]:
+        d: Deque[Dict[str, Any]] = deque(entries, maxlen=self.history_len if self.history_len > 0 else None)
+        self.timeline[conv_id] = (d, version)
+        self.timeline.move_to_end(conv_id)
+        while len(self.timeline) > max(1, TL_CACHE_MAX):
+            self.timeline.popitem(last=False)
+        return d
+
+    def timeline_append(self, conv_id: str, item: Dict[str, Any]) -> Deque[Dict[str, Any]]:
+        entry = self.timeline_get(conv_id)
+        if entry is None:
+            d = self.timeline_seed(conv_id, [], None)
+        else:
+            d = entry[0]
+        d.append(item)  # maxlen → przycięcie O(1)
+        return d
+
+    def timeline_ack(self, conv_id: str, version: Optional[int]) -> None:
+        entry = self.timeline.get(conv_id)
+        if entry is not None and version is not None:
+            self.timeline[conv_id] = (entry[0], version)
+
+    async def spawn_bg(self, coro, what: str = "bg") -> None:
+        """
+        Uruchamia zapis w tle (fire-and-forget) z referencją w _bg_tasks.
+        Przy pełnym limicie BG_TASKS_MAX wykonujemy go inline (backpressure zamiast gubienia zapisów).
+        """
+        if len(self._bg_tasks) >= max(1, BG_TASKS_MAX):
+            await coro
+            return
+        task = asyncio.create_task(coro, name=what)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_done)
+
+    def _bg_done(self, task: asyncio.Task) -> None:
+        self._bg_tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            log.warning("Błąd zadania w tle %s: %r", task.get_name(), exc)
+
+    def expect_reply(self, reply_id: str) -> asyncio.Future:
+        """Rejestruje Future na odpowiedź z in_reply_to == reply_id (przed wysłaniem żądania)."""
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[reply_id] = fut
+        return fut
+
+    def resolve_reply(self, in_reply_to: str, acl: Dict[str, Any]) -> bool:
+        """
+        Przekazuje odpowiedź do oczekującego Future. Dla PF-ów typu ACK (AGREE) w jego miejsce
+        wstawiamy od razu kolejny Future i przekazujemy go w wyniku – ramka końcowa (INFORM),
+        która przyjdzie zanim oczekujący się obudzi, nie zginie.
+        """
+        fut = self.pending.get(in_reply_to)
+        if fut is None:
+            return False
+        nxt: Optional[asyncio.Future] = None
+        if (acl.get("performative") or "").upper() in ACK_PFS:
+            nxt = fut.get_loop().create_future()
+            self.pending[in_reply_to] = nxt
+        else:
+            self.pending.pop(in_reply_to, None)
+        if not fut.done():
+            fut.set_result((acl, nxt))
+        return True
 
     class Dispatcher(CyclicBehaviour):
+        def kill(self, exit_code: Optional[Any] = None) -> None:
+            super().kill(exit_code)
+            # receive() czeka do RECV_TIMEOUT_S – wybudź go, żeby stop agenta nie wisiał
+            self.queue.put_nowait(None)
+
         async def run(self):
-            msg = await self.receive(timeout=1)
+            msg = await self.receive(timeout=RECV_TIMEOUT_S)
             if not msg:
                 return
 
-            # KB ma osobne conv_id – przekaż bez strażnika
+            from_bare = bare_jid(str(msg.sender))
+
+            # KB: osobne conv_id na żądanie → prosto do Future (bez strażnika i bez parsowania do AclMessage)
+            if from_bare == self.agent.kb_bare:
+                try:
+                    rep = decode_kb_reply(msg.body or "{}", msg.get_metadata(codec.ENCODING_META))
+                except ValueError as e:
+                    log.warning("Odrzucono niepoprawną ramkę KB: %s", e)
+                    return
+                fut = self.agent.kb_pending.get(rep.conversation_id or "")
+                if fut is not None and not fut.done() and rep.ontology == "MAS.KB":
+                    fut.set_result(rep)
+                return
+
+            # Metadane najpierw: odpowiedź, na którą nikt już nie czeka → odrzuć bez parsowania body
+            meta_irt = msg.get_metadata("in_reply_to")
+            if meta_irt and meta_irt not in self.agent.pending:
+                log.warning("DROP (meta) pf=%s from=%s conv=%s irt=%s",
+                            msg.get_metadata('performative'), from_bare, msg.get_metadata('conv'), meta_irt)
+                return
+
+            # Echo PRESENTER_REPLY nigdy nie jest konsumowane – odrzuć bez parsowania
+            body = msg.body or ""
+            if is_presenter_reply(body):
+                return
+
+            # Czat/puste ramki XMPP: odrzuć po pierwszym znaku, bez wyjątku z parsera
+            # (MessagePack+base64 ma metadaną encoding i idzie do dekodera bez tej bramki)
+            if not looks_like_json_object(body) and not msg.get_metadata(codec.ENCODING_META):
+                log_dispatch.debug("Dyspozytor: nie-JSON od %s – pomijam", msg.sender)
+                return
+
             try:
-                acl_raw = parse_acl_to_dict(msg.body)
+                acl_raw = parse_msg_to_dict(msg)
             except Exception as e:
-                print(f"[COORD] {now_iso()} Odrzucono nie-JSON od {msg.sender}: {e}")
+                log.warning("Odrzucono nie-JSON od %s: %s", msg.sender, e)
                 return
 
             conv = acl_raw.get("conversation_id") or ""
-            if conv and any(tag in conv for tag in ("-kbget-", "-kbput-", "-kbframe")):
-                q = self.agent.conv_queues.get(conv)
-                if q:
-                    await q.put(msg)
-                return
 
             # Strażnik korelacji (punkt 8)
-            from_bare = bare_jid(str(msg.sender))
             if not allow_if_correlated(self.agent.corr, acl_raw, from_bare=from_bare):
-                print(f"[COORD] {now_iso()} DROP pf={acl_raw.get('performative')} from={from_bare} "
-                      f"conv={conv} irt={acl_raw.get('in_reply_to')}")
+                log.warning("DROP pf=%s from=%s conv=%s irt=%s",
+                            acl_raw.get('performative'), from_bare, conv, acl_raw.get('in_reply_to'))
+                return
+
+            # Odpowiedź na nasze żądanie → prosto do Future
+            irt = acl_raw.get("in_reply_to")
+            if irt and self.agent.resolve_reply(irt, acl_raw):
                 return
 
-            pf   = acl_raw.get("performative")
-            cont = acl_raw.get("content") or {}
-            typ  = (cont.get("type") or "").upper()
+            pf   = acl_raw.get(_K_PF)
+            cont = acl_raw.get(_K_CONTENT) or {}
+            typ  = cont.get(_K_TYPE) or ""
+            if typ != _T_USER_MSG:  # nadawcy w MAS wysyłają UPPER – .upper() tylko gdy trafienie zawiedzie
+                typ = typ.upper()
 
             # Inicjalizacja rozmowy (USER_MSG)
-            if pf == "REQUEST" and typ == "USER_MSG":
+            if pf == _PF_REQUEST and typ == _T_USER_MSG:
                 if not conv:
-                    conv = f"sess-{now_ms()}"
-                    print(f"[COORD] {now_iso()} Brak conversation_id – nadano {conv}")
-
-                if conv not in self.agent.conv_queues:
-                    self.agent.conv_queues[conv] = asyncio.Queue()
-
-                    presenter_jid = (cont.get("meta") or {}).get("presenter_jid") or from_bare
-                    question = (cont.get("args") or {}).get("question") or ""
-
-                    self.agent.add_behaviour(
-                        CoordinatorAgent.ServeConversation(
-                            presenter_jid=presenter_jid,
-                            question=question,
-                            conv_id=conv,
-                            orig_acl=acl_raw,
-                        )
-                    )
-                    print(f"[COORD] {now_iso()} ← USER_MSG od {presenter_jid} conv={conv} q={question!r}")
+                    conv = new_reply_id("sess")
+                    log.info("Brak conversation_id – nadano %s", conv)
+
+                if conv not in self.agent.live_convs:
+                    presenter_jid = _dig(cont, "meta", "presenter_jid") or from_bare
+                    question = _dig(cont, "args", "question") or ""
+                    job = {
+                        "presenter_jid": presenter_jid,
+                        "question": question,
+                        "conv_id": conv,
+                        "orig_acl": acl_raw,
+                    }
+                    try:
+                        self.agent.work_q.put_nowait(job)
+                    except asyncio.QueueFull:
+                        # Nie blokujemy Dyspozytora: trwające rozmowy czekają na ramki, które on rozdziela
+                        log.warning("Uwaga: kolejka rozmów pełna (%s) – odmowa conv=%s", self.agent.work_q.maxsize, conv)
+                        await self._reply_busy(presenter_jid, conv, acl_raw.get("reply_with"))
+                        return
+                    self.agent.live_convs.add(conv)
+                    log.info("← USER_MSG od %s conv=%s q=%r", presenter_jid, conv, question)
                 return
 
             if not conv:
-                print(f"[COORD] {now_iso()} Ignoruję ramkę bez conversation_id pf={pf} typ={typ} od {msg.sender}")
+                log.info("Ignoruję ramkę bez conversation_id pf=%s typ=%s od %s", pf, typ, msg.sender)
                 return
-            q = self.agent.conv_queues.get(conv)
-            if q:
-                await q.put(msg)
-                print(f"[COORD] {now_iso()} Dyspozytor: dostarczono pf={pf} typ={typ} do conv={conv}")
-
-    class ServeConversation(OneShotBehaviour):
-        """Obsługa jednej rozmowy z KB-loggingiem i timeline."""
-        def __init__(self, presenter_jid: str, question: str, conv_id: str, orig_acl: Dict[str, Any]):
-            super().__init__()
+            # Odpowiedzi idą przez pending (Future); ramki niezamówione nie mają konsumenta
+            log.info("Ignoruję niezamówioną ramkę pf=%s typ=%s od %s conv=%s%s", pf, typ, from_bare, conv,
+                     "" if conv in self.agent.live_convs else " (rozmowa nieaktywna)")
+
+        async def _reply_busy(self, presenter_jid: str, conv: str, in_reply_to: Optional[str]) -> None:
+            body = _PRESENTER_REPLY_TPL.render(
+                conversation_id=conv,
+                content={"type": "PRESENTER_REPLY", "text": "Koordynator jest przeciążony. Spróbuj ponownie za chwilę."},
+            )
+            await self.send(build_msg(presenter_jid, "INFORM", conv, body, in_reply_to=in_reply_to))
+
+    class Worker(CyclicBehaviour):
+        """Jeden z MAX_CONCURRENCY_CAP stałych workerów: zadanie z work_q → ServeConversation (w tym samym tasku)."""
+        _get: Optional[asyncio.Future] = None  # oczekujące work_q.get()
+
+        def kill(self, exit_code: Optional[Any] = None) -> None:
+            super().kill(exit_code)
+            # anuluj czekanie na zadanie (strażnik None w pełnej kolejce by nie wszedł), żeby stop agenta nie wisiał
+            if self._get is not None:
+                self._get.cancel()
+
+        async def run(self):
+            self._get = asyncio.ensure_future(self.agent.work_q.get())
+            try:
+                job = await self._get
+            except asyncio.CancelledError:
+                if self.is_killed():
+                    return
+                raise
+            finally:
+                self._get = None
+            conv = CoordinatorAgent.ServeConversation(self, **job)
+            try:
+                await conv.run()
+            except Exception as e:
+                log.warning("[CONV %s] wyjątek w rozmowie: %r", job['conv_id'], e)
+
+    class ServeConversation:
+        """
+        Obsługa jednej rozmowy z KB-loggingiem i timeline.
+        Zwykły obiekt (nie behaviour SPADE): wykonuje się w tasku Workera i wysyła jego send(),
+        więc rozmowa nie tworzy własnej kolejki/Eventów ani nie przechodzi przez planistę behaviourów.
+        """
+        def __init__(self, worker: CyclicBehaviour, presenter_jid: str, question: str, conv_id: str,
+                     orig_acl: Dict[str, Any]):
+            self.agent = worker.agent
+            self.send = worker.send
             self.presenter_jid = presenter_jid
             self.question = question
             self.conv_id = conv_id
             self.orig_acl = orig_acl
+            self._tl_loading: Optional[asyncio.Future] = None  # zimny start timeline (single-flight)
+            self._fipa_request: Optional[Dict[str, Any]] = None  # projekcja orig_acl do promptu (stała w rozmowie)
 
         # ---------- KB helpery ----------
         def _kb_body(self, kb_conv: str, typ: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -248,111 +696,53 @@ class CoordinatorAgent(Agent):
             body.update(payload)
             return body
 
-        async def _kb_wait_for(self, kb_conv: str, *, want_types: List[str], timeout: float) -> Optional[Dict[str, Any]]:
-            q = self.agent.conv_queues.setdefault(kb_conv, asyncio.Queue())
-            deadline = time.time() + timeout
-            while time.time() < deadline:
-                try:
-                    m = await asyncio.wait_for(q.get(), timeout=max(0.05, min(1.0, deadline - time.time())))
-                except asyncio.TimeoutError:
-                    continue
-                try:
-                    acl = json.loads(m.body or "{}")
-                except Exception:
-                    continue
-                if (acl.get("ontology") == "MAS.KB"
-                        and acl.get("conversation_id") == kb_conv
-                        and str(acl.get("type", "")).upper() in [t.upper() for t in want_types]):
-                    return acl
-            return None
-
-        async def _kb_store_frame_ack(self, frame: Dict[str, Any]) -> bool:
-            key = f"session:{self.conv_id}:chat:frame:{now_ms()}"
-            payload = {
-                "key": key,
-                "content_type": "application/json",
-                "value": frame,
-                "tags": [f"conv:{self.conv_id}", f"type:{(frame.get('type','') or '').lower()}",
-                         f"from:{(frame.get('agent','') or '').lower()}"],
-            }
-            attempt = 0
-            while attempt < KB_MAX_TRIES:
-                attempt += 1
-                kb_conv = f"{self.conv_id}-kbframe-{now_ms()}"
-                if self.agent.kb_log:
-                    print(f"[COORD][KB] {now_iso()} → STORE(frame) attempt={attempt}/{KB_MAX_TRIES} key={key} conv={self.conv_id}")
-                body = self._kb_body(kb_conv, "STORE", payload)
-                t0 = time.perf_counter()
-                try:
-                    msg = Message(to=self.agent.kb_jid); msg.body = json.dumps(body, ensure_ascii=False)
-                    await self.send(msg)
-                    acl = await self._kb_wait_for(
-                        kb_conv,
-                        want_types=["STORED", "FAILURE.CONFLICT", "FAILURE.EXCEPTION"],
-                        timeout=self.agent.kb_timeout
-                    )
-                finally:
-                    self.agent.conv_queues.pop(kb_conv, None)
-                if not acl:
-                    self.agent.kb_store_timeout += 1
-                    kb_metrics.store_exc()
-                    if self.agent.kb_log:
-                        print(f"[COORD][KB] {now_iso()} !! timeout STORE(frame) conv={self.conv_id}")
-                    await asyncio.sleep(_exp_backoff_sleep(attempt))
-                    continue
-                t = str(acl.get("type","")).upper()
-                if t == "STORED":
-                    dt_ms = int((time.perf_counter() - t0) * 1000)
-                    self.agent.kb_store_ok += 1
-                    kb_metrics.store_ok_ms(dt_ms)
-                    if self.agent.kb_log:
-                        print(f"[COORD][KB] {now_iso()} ← STORED frame v={acl.get('version')} etag={acl.get('etag')} conv={self.conv_id} ({dt_ms} ms)")
-                    return True
-                if t == "FAILURE.CONFLICT":
-                    self.agent.kb_store_conflict += 1
-                    kb_metrics.store_conflict()
-                    if self.agent.kb_log:
-                        print(f"[COORD][KB] {now_iso()} CONFLICT na frame (nietypowe). Ponawiam z nowym ts. conv={self.conv_id}")
-                    key = f"session:{self.conv_id}:chat:frame:{now_ms()}"
-                    payload["key"] = key
-                    await asyncio.sleep(_exp_backoff_sleep(attempt))
-                    continue
-                kb_metrics.store_exc()
-                if self.agent.kb_log:
-                    print(f"[COORD][KB] {now_iso()} FAILURE na STORE(frame): {acl}")
-                return False
-            return False
+        def _kb_msg(self, body: Dict[str, Any]) -> Message:
+            msg = Message(to=_jid(self.agent.kb_jid), body=codec.encode_body(body, KB_ENCODING))
+            # conv/ontology w metadanych: KB rozpoznaje żądanie i jego conversation_id bez dekodowania body
+            meta = {"conv": body["conversation_id"], "ontology": "MAS.KB"}
+            if KB_ENCODING != codec.ENC_JSON:
+                meta[codec.ENCODING_META] = KB_ENCODING
+            msg.metadata = meta
+            return msg
+
+        async def _kb_request(self, kb_conv: str, body: Dict[str, Any]) -> Optional[KBReply]:
+            """Wysyła żądanie do KB i czeka na odpowiedź z conversation_id == kb_conv (Future, bez kolejki)."""
+            fut = asyncio.get_running_loop().create_future()
+            self.agent.kb_pending[kb_conv] = fut
+            try:
+                await self.send(self._kb_msg(body))
+                return await asyncio.wait_for(fut, timeout=self.agent.kb_timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.agent.kb_pending.pop(kb_conv, None)
 
         async def _kb_get_timeline_once(self) -> Tuple[List[Dict[str, Any]], Optional[int], bool]:
-            kb_conv = f"{self.conv_id}-kbget-{now_ms()}"
+            kb_conv = new_reply_id(f"{self.conv_id}-kbget")
             key = f"session:{self.conv_id}:chat:timeline:main"
             if self.agent.kb_log:
-                print(f"[COORD][KB] {now_iso()} → GET timeline key={key} conv={self.conv_id} timeout={self.agent.kb_timeout}s")
+                log_kb.info("→ GET timeline key=%s conv=%s timeout=%ss", key, self.conv_id, self.agent.kb_timeout)
             body = self._kb_body(kb_conv, "GET", {"key": key})
             t0 = time.perf_counter()
-            try:
-                msg = Message(to=self.agent.kb_jid); msg.body = json.dumps(body, ensure_ascii=False)
-                await self.send(msg)
-                acl = await self._kb_wait_for(kb_conv, want_types=["VALUE", "FAILURE.NOT_FOUND", "FAILURE.EXCEPTION"], timeout=self.agent.kb_timeout)
-            finally:
-                self.agent.conv_queues.pop(kb_conv, None)
+            acl = await self._kb_request(kb_conv, body)
 
             if not acl:
                 self.agent.kb_get_timeout += 1
                 kb_metrics.get_exc()
                 if self.agent.kb_log:
-                    print(f"[COORD][KB] {now_iso()} !! timeout GET timeline conv={self.conv_id}")
+                    log_kb.warning("!! timeout GET timeline conv=%s", self.conv_id)
                 return [], None, False
 
-            t = str(acl.get("type","")).upper()
+            t = acl.type.upper()
             if t == "VALUE":
                 dt_ms = int((time.perf_counter() - t0) * 1000)
-                content = acl.get("value") or []
-                version = acl.get("version")
+                content = acl.value or []
+                version = acl.version
                 self.agent.kb_get_ok += 1
                 kb_metrics.get_ok_ms(dt_ms)
                 if self.agent.kb_log:
-                    print(f"[COORD][KB] {now_iso()} ← VALUE timeline entries={len(content)} version={version} conv={self.conv_id} ({dt_ms} ms)")
+                    log_kb.info("← VALUE timeline entries=%s version=%s conv=%s (%s ms)",
+                                len(content), version, self.conv_id, dt_ms)
                 try:
                     return list(content), int(version) if version is not None else None, True
                 except Exception:
@@ -360,132 +750,150 @@ class CoordinatorAgent(Agent):
             if t == "FAILURE.NOT_FOUND":
                 kb_metrics.get_not_found()
                 if self.agent.kb_log:
-                    print(f"[COORD][KB] {now_iso()} ← NOT_FOUND timeline (brak historii) conv={self.conv_id}")
+                    log_kb.info("← NOT_FOUND timeline (brak historii) conv=%s", self.conv_id)
                 return [], None, True
             kb_metrics.get_exc()
             if self.agent.kb_log:
-                print(f"[COORD][KB] {now_iso()} ← FAILURE GET timeline: {acl}")
+                log_kb.warning("← FAILURE GET timeline: %s", acl)
             return [], None, False
 
         async def _kb_get_timeline(self) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+            cached = self.agent.timeline_get(self.conv_id)
+            if cached is not None:
+                return list(cached[0]), cached[1]
+            # Zimny start: jeden GET na rozmowę, nawet gdy czeka kilka współbieżnych ścieżek (DF ‖ USER_MSG);
+            # oczekujący budzą się w kolejności wywołań, więc kolejność dopisywania wpisów się nie zmienia.
+            if self._tl_loading is None or self._tl_loading.done():
+                self._tl_loading = asyncio.ensure_future(self._kb_load_timeline())
+            return await asyncio.shield(self._tl_loading)
+
+        async def _kb_load_timeline(self) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+            entries: List[Dict[str, Any]] = []
+            ver: Optional[int] = None
             attempt = 0
             while attempt < KB_MAX_TRIES:
                 attempt += 1
                 entries, ver, ok = await self._kb_get_timeline_once()
                 if ok:
-                    return entries, ver
+                    break
                 await asyncio.sleep(_exp_backoff_sleep(attempt))
-            return [], None
-
-        async def _kb_put_timeline_rw(self, entries: List[Dict[str, Any]], if_match_version: Optional[int]) -> bool:
+            d = self.agent.timeline_seed(self.conv_id, entries, ver)
+            return list(d), ver
+
+        async def _kb_append_timeline(self, item: Dict[str, Any]) -> bool:
+            """
+            Jedno RPC APPEND: KB zapisuje frame i dopisuje item do timeline w jednej transakcji.
+            Wersję z INFORM {type:"APPENDED"} odnotowujemy w kopii lokalnej. False po wyczerpaniu prób.
+            """
             key = f"session:{self.conv_id}:chat:timeline:main"
+            payload = {
+                "key": key,
+                "content_type": "application/json",
+                "item": item,
+                "max_len": self.agent.history_len,
+                "tags": [f"conv:{self.conv_id}", "kind:timeline"],
+                "frame_key": f"session:{self.conv_id}:chat:frame:{now_ms()}",
+                "frame_tags": [f"conv:{self.conv_id}", f"type:{(item.get('type','') or '').lower()}",
+                               f"from:{(item.get('agent','') or '').lower()}"],
+            }
             attempt = 0
-            current_entries = entries
-            current_if_match = f"v{int(if_match_version)}" if isinstance(if_match_version, int) else None
-
             while attempt < KB_MAX_TRIES:
                 attempt += 1
-                kb_conv = f"{self.conv_id}-kbput-{now_ms()}"
+                kb_conv = new_reply_id(f"{self.conv_id}-kbapp")
                 if self.agent.kb_log:
-                    print(f"[COORD][KB] {now_iso()} → STORE(timeline) attempt={attempt}/{KB_MAX_TRIES} "
-                          f"{'(tworzenie nowej)' if current_if_match is None else f'if_match={current_if_match}'} conv={self.conv_id}")
-                body = self._kb_body(kb_conv, "STORE", {
-                    "key": key,
-                    "content_type": "application/json",
-                    "value": current_entries,
-                    "tags": [f"conv:{self.conv_id}", "kind:timeline"],
-                    "if_match": current_if_match,
-                })
+                    log_kb.info("→ APPEND(timeline) attempt=%s/%s key=%s conv=%s", attempt, KB_MAX_TRIES, key, self.conv_id)
+                body = self._kb_body(kb_conv, "APPEND", payload)
                 t0 = time.perf_counter()
-                try:
-                    msg = Message(to=self.agent.kb_jid); msg.body = json.dumps(body, ensure_ascii=False)
-                    await self.send(msg)
-                    acl = await self._kb_wait_for(kb_conv, want_types=["STORED", "FAILURE.CONFLICT", "FAILURE.EXCEPTION"], timeout=self.agent.kb_timeout)
-                finally:
-                    self.agent.conv_queues.pop(kb_conv, None)
+                acl = await self._kb_request(kb_conv, body)
 
                 if not acl:
                     self.agent.kb_store_timeout += 1
                     kb_metrics.store_exc()
                     if self.agent.kb_log:
-                        print(f"[COORD][KB] {now_iso()} !! timeout STORE(timeline) conv={self.conv_id}")
+                        log_kb.warning("!! timeout APPEND(timeline) conv=%s", self.conv_id)
                     await asyncio.sleep(_exp_backoff_sleep(attempt))
                     continue
 
-                t = str(acl.get("type","")).upper()
-                if t == "STORED":
+                t = acl.type.upper()
+                if t == "APPENDED":
                     dt_ms = int((time.perf_counter() - t0) * 1000)
                     self.agent.kb_store_ok += 1
                     kb_metrics.store_ok_ms(dt_ms)
+                    self.agent.timeline_ack(self.conv_id, acl.version)
                     if self.agent.kb_log:
-                        print(f"[COORD][KB] {now_iso()} ← STORED timeline v={acl.get('version')} etag={acl.get('etag')} conv={self.conv_id} ({dt_ms} ms)")
+                        log_kb.info("← APPENDED timeline v=%s conv=%s (%s ms)", acl.version, self.conv_id, dt_ms)
                     return True
 
                 if t == "FAILURE.CONFLICT":
+                    # KB ponawia konflikty wersji samo; tu trafiamy dopiero po wyczerpaniu jego prób
                     self.agent.kb_store_conflict += 1
                     kb_metrics.store_conflict()
                     if self.agent.kb_log:
-                        print(f"[COORD][KB] {now_iso()} CONFLICT timeline – odczyt i ponowna próba conv={self.conv_id}")
-                    curr, ver = await self._kb_get_timeline()
-                    merged = list(curr or [])
-                    merged.extend([e for e in current_entries if e not in merged])
-                    if self.agent.history_len > 0 and len(merged) > self.agent.history_len:
-                        merged = merged[-self.agent.history_len:]
-                    current_entries = merged
-                    current_if_match = f"v{int(ver)}" if isinstance(ver, int) else None
+                        log_kb.info("CONFLICT przy APPEND – ponawiam conv=%s", self.conv_id)
                     await asyncio.sleep(_exp_backoff_sleep(attempt))
                     continue
 
                 kb_metrics.store_exc()
                 if self.agent.kb_log:
-                    print(f"[COORD][KB] {now_iso()} FAILURE STORE(timeline): {acl}")
+                    log_kb.warning("FAILURE APPEND(timeline): %s", acl)
                 return False
 
-            return False
-
-        async def _kb_log_acl_and_update_timeline(self, acl: Dict[str, Any]) -> List[Dict[str, Any]]:
-            item = {
-                "ts": now_iso(),
-                "agent": str(acl.get("sender") or "").strip() or "Unknown",
-                "pf": str(acl.get("performative") or ""),
-                "type": str((acl.get("content") or {}).get("type") or ""),
-                "text": _history_text_from_acl(acl),
-            }
-            ok_frame = await self._kb_store_frame_ack(item)
-            if not ok_frame and self.agent.kb_log:
-                print(f"[COORD][KB] {now_iso()} Ostrzeżenie: frame niepotwierdzony (kontynuuję). conv={self.conv_id}")
-
-            curr, ver = await self._kb_get_timeline()
-            curr = list(curr or [])
-            curr.append(item)
             if self.agent.kb_log:
-                if ver is None:
-                    print(f"[COORD][KB] {now_iso()} Historia: tworzenie pierwszej wersji (v1) conv={self.conv_id}")
-                else:
-                    print(f"[COORD][KB] {now_iso()} Historia: dopisano wpis (v{ver} -> v{ver+1}) conv={self.conv_id}")
-            if self.agent.history_len > 0 and len(curr) > self.agent.history_len:
-                curr = curr[-self.agent.history_len:]
+                log_kb.warning("Błąd zapisu timeline (po próbach). conv=%s", self.conv_id)
+            return False
 
-            ok_tl = await self._kb_put_timeline_rw(curr, ver)
-            if not ok_tl and self.agent.kb_log:
-                print(f"[COORD][KB] {now_iso()} Błąd zapisu timeline (po próbach). conv={self.conv_id}")
+        async def _kb_log_acl_and_update_timeline(self, acl: Dict[str, Any]) -> None:
+            await self._timeline_add({"ts": now_iso(), **_timeline_head(acl)})
 
-            return curr
+        async def _timeline_add(self, item: Dict[str, Any]) -> None:
+            # Kopia lokalna jest autorytatywna: dopisz synchronicznie, zapis do KB w tle
+            if self.agent.timeline_get(self.conv_id) is None:
+                await self._kb_get_timeline()  # zimny start → jednorazowy GET
+            self.agent.timeline_append(self.conv_id, item)  # w miejscu, deque(maxlen) przycina O(1)
+            await self.agent.spawn_bg(self._kb_append_timeline(item), what=f"kb-append:{self.conv_id}")
+            await asyncio.sleep(0)  # oddaj pętlę: APPEND wychodzi od razu, inne rozmowy się przeplatają
 
         # ---------- DF ----------
         async def df_lookup(self) -> List[Any]:
-            async def _query(need_value: str) -> List[Any]:
+            """
+            Kandydaci z DF: cache z TTL (DF_TTL_S) + single-flight – równoległe chybienia czekają na jedno zapytanie.
+            Krok DF trafia do timeline KAŻDEJ rozmowy; cached=True, gdy wynik nie pochodzi z jej własnego zapytania.
+            """
+            key = f"{DF_MODE}:{NEED_CAP}"
+            result = self.agent.df_cache_get(key)
+            cached = result is not None
+            if cached:
+                log.info("[DF] z cache count=%s conv=%s", len(result[0]), self.conv_id)
+            else:
+                task = self.agent.df_inflight.get(key)
+                if task is None:
+                    task = asyncio.ensure_future(self._df_query())
+                    self.agent.df_inflight[key] = task
+
+                    def _done(t: asyncio.Future, key: str = key) -> None:
+                        self.agent.df_inflight.pop(key, None)
+                        if not t.cancelled() and t.exception() is None and t.result()[0]:
+                            self.agent.df_cache_put(key, t.result())
+                    task.add_done_callback(_done)
+                else:
+                    cached = True  # wynik cudzego zapytania w toku
+                result = await asyncio.shield(task)
+            candidates, head = result
+            if head:
+                await self._timeline_add({
+                    "ts": now_iso(), **head,
+                    "candidates": [c.get("jid") if isinstance(c, dict) else c for c in candidates],
+                    "cached": cached,
+                })
+            return candidates
+
+        async def _df_query(self) -> Tuple[List[Any], Dict[str, Any]]:
+            """(kandydaci, nagłówek wpisu timeline z INFORM DF); bez INFORM → ([], {})."""
+            async def _query(need_value: str) -> Tuple[List[Any], Dict[str, Any]]:
                 reply_id = new_reply_id("dfq")
-                msg = Message(to=self.agent.registry_jid)
-                msg.set_metadata("conv", self.conv_id)
-                msg.set_metadata("performative", "QUERY-REF")
-                msg.body = make_acl(
-                    "QUERY-REF", "Coordinator", "Registry",
-                    content={"need": need_value},
-                    conversation_id=self.conv_id,
-                    reply_with=reply_id,
-                    protocol="fipa-query",
-                )
+                body = _DF_QUERY_TPL.render(conversation_id=self.conv_id, reply_with=reply_id,
+                                            content={"need": need_value})
+                msg = build_msg(self.agent.registry_jid, "QUERY-REF", self.conv_id, body, reply_with=reply_id)
                 # Rejestr oczekiwań: INFORM z DF (punkt 8)
                 self.agent.corr.register(
                     self.conv_id, reply_id,
@@ -493,69 +901,49 @@ class CoordinatorAgent(Agent):
                     allow_pf=["INFORM"],
                     note="DF QUERY-REF → INFORM"
                 )
-                print(f"[COORD] {now_iso()} → DF {self.agent.registry_jid} QUERY-REF need={need_value} conv={self.conv_id}")
+                fut = self.agent.expect_reply(reply_id)
+                log.info("→ DF %s QUERY-REF need=%s conv=%s", self.agent.registry_jid, need_value, self.conv_id)
                 await self.send(msg)
 
-                q: asyncio.Queue = self.agent.conv_queues[self.conv_id]
-                deadline = time.time() + REQ_TIMEOUT_S
-                while time.time() < deadline:
-                    remain = max(0, deadline - time.time())
-                    try:
-                        m: Message = await asyncio.wait_for(q.get(), timeout=min(remain, 1.0))
-                    except asyncio.TimeoutError:
-                        continue
-                    try:
-                        acl = parse_acl_to_dict(m.body)
-                    except Exception:
-                        continue
-                    if acl.get("conversation_id") != self.conv_id:
-                        continue
-                    if acl.get("performative") == "INFORM":
-                        await self._kb_log_acl_and_update_timeline(acl)
-                        cont = acl.get("content") or {}
-                        profiles = cont.get("profiles") or []
-                        candidates = profiles or (cont.get("candidates") or [])
-                        src = "profiles" if profiles else "candidates"
-                        print(f"[COORD] {now_iso()} ← DF INFORM {src} count={len(candidates)} conv={self.conv_id}")
-                        return candidates
-                print(f"[COORD] {now_iso()} [DF] timeout po {REQ_TIMEOUT_S}s conv={self.conv_id}")
-                return []
+                try:
+                    acl, _nxt = await asyncio.wait_for(fut, timeout=REQ_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    log.warning("[DF] timeout po %ss conv=%s", REQ_TIMEOUT_S, self.conv_id)
+                    return [], {}
+                finally:
+                    self.agent.pending.pop(reply_id, None)
+
+                if acl.get("performative") != "INFORM":
+                    log.warning("[DF] nieoczekiwany PF=%s conv=%s", acl.get('performative'), self.conv_id)
+                    return [], {}
+                cont = acl.get("content") or {}
+                profiles = cont.get("profiles") or []
+                candidates = profiles or (cont.get("candidates") or [])
+                src = "profiles" if profiles else "candidates"
+                log.info("← DF INFORM %s count=%s conv=%s", src, len(candidates), self.conv_id)
+                return candidates, _timeline_head(acl)
 
             if DF_MODE == "ALL":
                 got = await _query("ALL")
-                if not got:
-                    print(f"[COORD] {now_iso()} [DF] ALL→pusto, fallback do NEED={NEED_CAP}")
+                if not got[0]:
+                    log.info("[DF] ALL→pusto, fallback do NEED=%s", NEED_CAP)
                     got = await _query(NEED_CAP)
                 return got
             else:
                 return await _query(NEED_CAP)
 
         def _normalize_candidates(self, raw_list: List[Any]) -> List[Dict[str, Any]]:
-            norm: List[Dict[str, Any]] = []
-            for item in raw_list:
-                if isinstance(item, str):
-                    norm.append({
-                        "jid": item, "name": item, "description": "",
-                        "capabilities": [NEED_CAP], "skills": [], "status": "online",
-                    })
-                elif isinstance(item, dict):
-                    norm.append({
-                        "jid": item.get("jid", ""),
-                        "name": item.get("name", item.get("jid", "")),
-                        "description": item.get("description", ""),
-                        "capabilities": item.get("capabilities", []),
-                        "skills": item.get("skills", []),
-                        "status": item.get("status", "online"),
-                    })
-            return [c for c in norm if c.get("jid")]
+            return normalize_candidates(raw_list, NEED_CAP)
 
         def _build_fipa_request_for_prompt(self) -> Dict[str, Any]:
+            if self._fipa_request is not None:
+                return self._fipa_request
             content = self.orig_acl.get("content") or {}
             args = (content.get("args") or {})
             domain_tags = args.get("domain_tags") or []
             if not isinstance(domain_tags, list):
                 domain_tags = [domain_tags]
-            return {
+            self._fipa_request = {
                 "performative": self.orig_acl.get("performative"),
                 "ontology": self.orig_acl.get("ontology"),
                 "sender": self.orig_acl.get("sender"),
@@ -564,72 +952,108 @@ class CoordinatorAgent(Agent):
                     "args": {"question": args.get("question"), "domain_tags": domain_tags}
                 }
             }
-
-        async def _ai_select_candidate(self, candidates: List[Dict[str, Any]], history: List[Dict[str, Any]]) -> Optional[str]:
+            return self._fipa_request
+
+        @staticmethod
+        def _slim_candidates(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            # Selektor potrzebuje jid/capabilities/status + skrótu opisu (dopasowanie merytoryczne)
+            # i pierwszych skills (domain_tags z żądania dopasowuje do skills); name tylko gdy różni się od jid
+            out: List[Dict[str, Any]] = []
+            for c in candidates:
+                jid = c["jid"]
+                slim: Dict[str, Any] = {
+                    "jid": jid,
+                    "capabilities": c.get("capabilities") or [],
+                    "status": c.get("status"),
+                }
+                name = c.get("name")
+                if name and name != jid:
+                    slim["name"] = name
+                skills = c.get("skills")
+                if AI_SKILLS_MAX > 0 and skills and isinstance(skills, list):
+                    slim["skills"] = skills[:AI_SKILLS_MAX]
+                desc = c.get("description")
+                if desc:
+                    slim["description"] = _compact(str(desc), AI_TEXT_MAX)
+                out.append(slim)
+            return out
+
+        def _slim_history(self, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            n = min(self.agent.history_len, AI_HISTORY_MAX) if self.agent.history_len > 0 else AI_HISTORY_MAX
+            tail = history[-n:] if n > 0 else []
+            return [{
+                "agent": e.get("agent"),
+                "type": e.get("type"),
+                "text": _compact(str(e.get("text") or ""), AI_TEXT_MAX),
+            } for e in tail if isinstance(e, dict)]
+
+        async def _ai_select_candidate(self, candidates: List[Dict[str, Any]], history: List[Dict[str, Any]],
+                                       jid_set: Optional[set] = None) -> Optional[str]:
             if not candidates:
                 return None
+            if jid_set is None:
+                jid_set = {c["jid"] for c in candidates}
+            cache_key: Optional[Tuple[Any, ...]] = None
+            if SELECT_CACHE_TTL > 0:
+                tags = self._build_fipa_request_for_prompt()["content"]["args"]["domain_tags"]
+                cache_key = (NEED_CAP, tuple(sorted(jid_set)), tuple(sorted(str(t) for t in tags)))
+                cached = self.agent.sel_cache_get(cache_key)
+                if cached is not None and cached in jid_set:
+                    log.info("[AI] Wybór z cache: %s", cached)
+                    return cached
             selector_input = {
                 "conversation_id": self.conv_id,
                 "required_capability": NEED_CAP,
                 "df_timestamp": now_iso(),
                 "fipa_request": self._build_fipa_request_for_prompt(),
-                "candidates": candidates,
-                "history": history,
+                "candidates": self._slim_candidates(candidates),
+                "history": self._slim_history(history),
             }
-            if DEBUG_AI:
+            if log_ai.isEnabledFor(logging.DEBUG):
                 try:
                     preview = {
                         "selector_input": selector_input,
-                        "system_prompt_preview": (SELECTOR_SYSTEM_PROMPT or "")[:240] +
-                            ("..." if (SELECTOR_SYSTEM_PROMPT and len(SELECTOR_SYSTEM_PROMPT) > 240) else "")
+                        "system_prompt_preview": _SYS_PROMPT_PREVIEW,
                     }
-                    print(f"[COORD] {now_iso()} [AI][DEBUG] payload → selector:\n"
-                          f"{json.dumps(preview, ensure_ascii=False, indent=2)}")
+                    log_ai.debug("[AI][DEBUG] payload → selector:\n%s", json.dumps(preview, ensure_ascii=False, indent=2))
                 except Exception as e:
-                    print(f"[COORD] {now_iso()} [AI][DEBUG] Błąd podczas logowania payloadu: {e}")
-
-            messages = [
-                {"role": "system", "content": SELECTOR_SYSTEM_PROMPT or ""},
-                {"role": "user", "content": json.dumps(selector_input, ensure_ascii=False)},
-            ]
-            res = await self.agent.ai.achat_from_history(
-                messages,
-                caller="Coordinator",
-                extra={"response_format": {"type": "json_object"}}
-            )
-            if res.get("error"):
-                print(f"[COORD] {now_iso()} [AI] ERROR {res['error']}")
+                    log_ai.debug("[AI][DEBUG] Błąd podczas logowania payloadu: %s", e)
+
+            res = await self.agent.ai_batcher.submit(selector_input)
+            err = res.get("error")
+            if err:
+                log.warning("[AI] ERROR %s", err)
+                if isinstance(err, dict) and err.get("type") == "rate_limited":
+                    await self.agent.limiter.on_overload()
+                    log.info("[AI] 429 → limit rozmów=%s", self.agent.limiter.limit)
                 return None
+            await self.agent.limiter.on_ok()
             txt = (res.get("text") or "").strip()
-            if DEBUG_AI:
-                print(f"[COORD] {now_iso()} [AI][DEBUG] raw response: {txt!r}")
+            log_ai.debug("[AI][DEBUG] raw response: %r", txt)
             try:
-                data = json.loads(txt) if txt else {}
+                data = codec.loads(txt) if txt else {}
             except Exception as e:
-                print(f"[COORD] {now_iso()} [AI] Niepoprawny JSON z selektora: {e} / {txt!r}")
+                log.warning("[AI] Niepoprawny JSON z selektora: %s / %r", e, txt)
                 return None
             selected = data.get("selected_jid")
             if not selected:
-                print(f"[COORD] {now_iso()} [AI] Brak selected_jid w odpowiedzi.")
+                log.info("[AI] Brak selected_jid w odpowiedzi.")
                 return None
-            c_jids = {c["jid"] for c in candidates}
-            if selected not in c_jids:
-                print(f"[COORD] {now_iso()} [AI] selected_jid={selected} nie jest na liście kandydatów.")
+            if selected not in jid_set:
+                log.warning("[AI] selected_jid=%s nie jest na liście kandydatów.", selected)
                 return None
-            print(f"[COORD] {now_iso()} [AI] Wybrano: {selected} (powód={data.get('reason')}, conf={data.get('confidence')})")
+            log.info("[AI] Wybrano: %s (powód=%s, conf=%s)", selected, data.get('reason'), data.get('confidence'))
+            if cache_key is not None:
+                self.agent.sel_cache_put(cache_key, selected)
             return selected
 
         async def ask_specialist(self, specialist_jid: str, history: List[Dict[str, Any]]) -> Optional[str]:
             req_id = new_reply_id("ask")
-            msg = Message(to=specialist_jid)
-            msg.set_metadata("conv", self.conv_id)
-            msg.set_metadata("performative", "REQUEST")
-            msg.body = make_acl(
-                "REQUEST", "Coordinator", "Specialist",
+            body = _SPEC_REQUEST_TPL.render(
+                conversation_id=self.conv_id, reply_with=req_id,
                 content={"type": "ASK_EXPERT", "args": {"question": self.question, "history": history}},
-                conversation_id=self.conv_id,
-                reply_with=req_id,
             )
+            msg = build_msg(specialist_jid, "REQUEST", self.conv_id, body, reply_with=req_id)
             # Rejestr oczekiwań: AGREE i INFORM z tego samego specjalisty (jedno oczekiwanie z dwoma PF)
             self.agent.corr.register(
                 self.conv_id, req_id,
@@ -637,66 +1061,110 @@ class CoordinatorAgent(Agent):
                 allow_pf=["AGREE", "INFORM"],
                 note="SPEC REQUEST → AGREE/INFORM"
             )
-            print(f"[COORD] {now_iso()} → SPEC {specialist_jid} REQUEST.ASK_EXPERT conv={self.conv_id} q={self.question!r}")
+            fut: Optional[asyncio.Future] = self.agent.expect_reply(req_id)
+            log.info("→ SPEC %s REQUEST.ASK_EXPERT conv=%s q=%r", specialist_jid, self.conv_id, self.question)
             await self.send(msg)
 
-            q: asyncio.Queue = self.agent.conv_queues[self.conv_id]
-            deadline = time.time() + REQ_TIMEOUT_S
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + REQ_TIMEOUT_S
             got_agree = False
+            try:
+                while fut is not None:
+                    try:
+                        acl, fut = await asyncio.wait_for(fut, timeout=max(0.0, deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+                    pf = acl.get("performative")
+                    cont = acl.get("content") or {}
+                    typ = (cont.get("type") or "").upper()
 
-            while time.time() < deadline:
-                remain = max(0, deadline - time.time())
-                try:
-                    m: Message = await asyncio.wait_for(q.get(), timeout=min(remain, 1.0))
-                except asyncio.TimeoutError:
-                    continue
-                try:
-                    acl = parse_acl_to_dict(m.body)
-                except Exception:
-                    continue
-                if acl.get("conversation_id") != self.conv_id:
-                    continue
-                pf = acl.get("performative")
-                cont = acl.get("content") or {}
-                typ = (cont.get("type") or "").upper()
-
-                if pf in ("AGREE", "INFORM"):
-                    await self._kb_log_acl_and_update_timeline(acl)
+                    if pf in ("AGREE", "INFORM"):
+                        await self._kb_log_acl_and_update_timeline(acl)
 
-                if pf == "AGREE":
-                    if not got_agree:
-                        print(f"[COORD] {now_iso()} ← SPEC AGREE conv={self.conv_id}")
-                        got_agree = True
-                    continue
+                    if pf == "AGREE":
+                        if not got_agree:
+                            log.info("← SPEC AGREE conv=%s", self.conv_id)
+                            got_agree = True
+                        continue
 
-                if pf == "INFORM" and typ == "RESULT":
-                    ans = (cont.get("result") or {}).get("answer")
-                    print(f"[COORD] {now_iso()} ← SPEC INFORM.RESULT conv={self.conv_id} answer={ans!r}")
-                    return ans
-            print(f"[COORD] {now_iso()} [SPEC] timeout po {REQ_TIMEOUT_S}s conv={self.conv_id}")
+                    if pf == "INFORM" and typ == "RESULT":
+                        ans = _dig(cont, "result", "answer")
+                        log.info("← SPEC INFORM.RESULT conv=%s answer=%r", self.conv_id, ans)
+                        await self.agent.limiter.on_ok()
+                        return ans
+                    log.warning("[SPEC] nieoczekiwana ramka pf=%s typ=%s conv=%s", pf, typ, self.conv_id)
+                    return None
+            finally:
+                self.agent.pending.pop(req_id, None)
+            await self.agent.limiter.on_overload()
+            log.warning("[SPEC] timeout po %ss conv=%s (limit rozmów=%s)",
+                        REQ_TIMEOUT_S, self.conv_id, self.agent.limiter.limit)
             return None
 
+        async def _ask_hedged(self, jids: List[str], history: List[Dict[str, Any]]) -> Optional[str]:
+            """
+            Pierwszy specjalista od razu; kolejny, gdy poprzedni zawiódł (domyślnie szeregowo, jak MAX_RETRIES)
+            albo – przy HEDGE_DELAY_S > 0 – milczy dłużej niż HEDGE_DELAY_S.
+            Pierwsza odpowiedź wygrywa, pozostałe zadania są anulowane (ich spóźnione ramki odrzuca Dyspozytor:
+            reply_with znika z pending). ASK_RACE: wszyscy kandydaci od razu (każda próba ma własne reply_with).
+            """
+            running: set = set()
+            nxt = 0
+
+            def launch() -> None:
+                nonlocal nxt
+                jid = jids[nxt]
+                nxt += 1
+                log.info("[CONV %s] Próba %s/%s → %s", self.conv_id, nxt, len(jids), jid)
+                running.add(asyncio.ensure_future(self.ask_specialist(jid, history)))
+
+            launch()
+            while ASK_RACE and nxt < len(jids):
+                launch()
+            try:
+                while running:
+                    more = nxt < len(jids)
+                    done, _ = await asyncio.wait(
+                        running, timeout=HEDGE_DELAY_S if (more and HEDGE_DELAY_S > 0) else None,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if not done:
+                        log.info("[CONV %s] Brak odpowiedzi po %ss – równoległa próba", self.conv_id, HEDGE_DELAY_S)
+                        launch()
+                        continue
+                    for t in done:
+                        running.discard(t)
+                        if t.exception() is not None:
+                            log.warning("[CONV %s] Błąd zapytania do specjalisty: %r", self.conv_id, t.exception())
+                        elif t.result():
+                            return t.result()
+                    if nxt < len(jids):  # któraś próba zawiodła → od razu następny kandydat
+                        launch()
+                if nxt >= MAX_RETRIES:
+                    log.warning("[CONV %s] Limit prób %s osiągnięty", self.conv_id, MAX_RETRIES)
+                return None
+            finally:
+                for t in running:
+                    t.cancel()
+
         async def reply_to_presenter(self, text: str) -> None:
-            msg = Message(to=self.presenter_jid)
-            msg.set_metadata("conv", self.conv_id)
-            msg.set_metadata("performative", "INFORM")
-            msg.body = make_acl(
-                "INFORM", "Coordinator", "Presenter",
-                content={"type": "PRESENTER_REPLY", "text": text},
+            # in_reply_to w metadanych: Prezenter koreluje odpowiedź bez parsowania body
+            msg = build_msg(self.presenter_jid, "INFORM", self.conv_id, _PRESENTER_REPLY_TPL.render(
                 conversation_id=self.conv_id,
-            )
-            print(f"[COORD] {now_iso()} → PRESENTER {self.presenter_jid} INFORM.PRESENTER_REPLY conv={self.conv_id} text={_short(text)!r}")
+                content={"type": "PRESENTER_REPLY", "text": text},
+            ), in_reply_to=self.orig_acl.get("reply_with"))
+            log.info("→ PRESENTER %s INFORM.PRESENTER_REPLY conv=%s text=%r", self.presenter_jid, self.conv_id, _short(text))
             await self.send(msg)
 
         async def run(self):
-            async with self.agent.sem:
-                print(f"[COORD] {now_iso()} [CONV {self.conv_id}] start")
+            async with self.agent.limiter:
+                log.info("[CONV %s] start", self.conv_id)
                 try:
-                    # (0) Zaloguj USER_MSG do KB i uaktualnij timeline (z ACK/RW)
-                    history_after_user = await self._kb_log_acl_and_update_timeline(self.orig_acl)
-
-                    # (1) DF lookup (+log DF INFORM do KB)
-                    raw_candidates = await self.df_lookup()
+                    # (0) USER_MSG do timeline (zimny start: GET z KB) ‖ (1) DF lookup (+log DF INFORM) – równolegle
+                    _, raw_candidates = await asyncio.gather(
+                        self._kb_log_acl_and_update_timeline(self.orig_acl),
+                        self.df_lookup(),
+                    )
                     if not raw_candidates:
                         await self.reply_to_presenter("Brak dostępnych specjalistów (ASK_EXPERT).")
                         return
@@ -706,36 +1174,26 @@ class CoordinatorAgent(Agent):
                         await self.reply_to_presenter("Brak poprawnych profili kandydatów.")
                         return
 
-                    print(f"[COORD] {now_iso()} [CONV {self.conv_id}] Kandydaci (norm): {[c['jid'] for c in candidates]}")
+                    jids = [c["jid"] for c in candidates]
+                    jid_set = set(jids)
+                    log.info("[CONV %s] Kandydaci (norm): %s", self.conv_id, jids)
 
-                    # (2) Pobierz timeline i przekaż do selektora
-                    tl, _ver = await self._kb_get_timeline()
-                    history_for_ai = tl if tl else history_after_user
-                    selected_jid = await self._ai_select_candidate(candidates, history_for_ai)
+                    # (2) Timeline (kopia lokalna) do selektora
+                    history_for_ai, _ver = await self._kb_get_timeline()
+                    selected_jid = await self._ai_select_candidate(candidates, history_for_ai, jid_set)
 
                     if not selected_jid:
                         avail = [c for c in candidates if str(c.get("status","")).lower() in ("online","available","ready")]
                         with_cap = [c for c in avail if NEED_CAP in (c.get("capabilities") or [])]
                         prefer = with_cap if with_cap else (avail if avail else candidates)
-                        selected_jid = sorted([c["jid"] for c in prefer])[0]
-                        print(f"[COORD] {now_iso()} [FALLBACK] Wybrano deterministycznie: {selected_jid}")
+                        selected_jid = min(c["jid"] for c in prefer)
+                        log.info("[FALLBACK] Wybrano deterministycznie: %s", selected_jid)
 
                     # (3) Timeline do specjalisty
-                    tl2, _ver2 = await self._kb_get_timeline()
-                    history_for_specialist = tl2 if tl2 else history_after_user
-
-                    answer: Optional[str] = None
-                    attempts = 0
-                    ordered_try = [selected_jid] + [c["jid"] for c in candidates if c["jid"] != selected_jid]
-                    for jid in ordered_try:
-                        attempts += 1
-                        print(f"[COORD] {now_iso()} [CONV {self.conv_id}] Próba {attempts}/{MAX_RETRIES} → {jid}")
-                        answer = await self.ask_specialist(jid, history_for_specialist)
-                        if answer:
-                            break
-                        if attempts >= MAX_RETRIES:
-                            print(f"[COORD] {now_iso()} [CONV {self.conv_id}] Limit prób {MAX_RETRIES} osiągnięty")
-                            break
+                    history_for_specialist, _ver2 = await self._kb_get_timeline()
+
+                    ordered_try = [selected_jid, *(j for j in jids if j != selected_jid)]
+                    answer = await self._ask_hedged(ordered_try[:max(1, MAX_RETRIES)], history_for_specialist)
 
                     # (4) Odpowiedź do Presentera
                     if answer:
@@ -745,26 +1203,27 @@ class CoordinatorAgent(Agent):
                 finally:
                     if CONV_GRACE_SEC > 0:
                         await asyncio.sleep(CONV_GRACE_SEC)
-                    try:
-                        q = self.agent.conv_queues.pop(self.conv_id, None)
-                        if q:
-                            while not q.empty():
-                                _ = q.get_nowait()
-                    except Exception:
-                        pass
-                    print(f"[COORD] {now_iso()} [CONV {self.conv_id}] koniec")
+                    self.agent.live_convs.discard(self.conv_id)
+                    log.info("[CONV %s] koniec", self.conv_id)
 
     async def setup(self):
-        print(f"[COORD] Start jako {self.jid}. DF={self.registry_jid} "
-              f"NEED={NEED_CAP} TIMEOUT={REQ_TIMEOUT_S}s RETRIES={MAX_RETRIES} "
-              f"CONCURRENCY={MAX_CONCURRENCY} DF_MODE={DF_MODE} KB={self.kb_jid} "
-              f"HIST={self.history_len}@{self.kb_timeout}s")
-        print(f"[COORD][KB] Cel KB: {self.kb_jid} | timeout={self.kb_timeout}s | historia_max={self.history_len} | logiKB={'ON' if self.kb_log else 'OFF'}")
+        log.info("Start jako %s. DF=%s NEED=%s TIMEOUT=%ss RETRIES=%s CONCURRENCY=%s..%s DF_MODE=%s KB=%s HIST=%s@%ss",
+                 self.jid, self.registry_jid, NEED_CAP, REQ_TIMEOUT_S, MAX_RETRIES, MAX_CONCURRENCY,
+                 MAX_CONCURRENCY_CAP, DF_MODE, self.kb_jid, self.history_len, self.kb_timeout)
+        log_kb.info("Cel KB: %s | timeout=%ss | historia_max=%s | logiKB=%s | kodowanie=%s",
+                    self.kb_jid, self.kb_timeout, self.history_len, 'ON' if self.kb_log else 'OFF', KB_ENCODING)
         if getattr(kb_metrics, "enabled", False):
-            print("[COORD][KB] Metryki: WŁĄCZONE")
+            log_kb.info("Metryki: WŁĄCZONE")
         else:
-            print("[COORD][KB] Metryki: wyłączone (noop)")
+            log_kb.info("Metryki: wyłączone (noop)")
         self.add_behaviour(self.Dispatcher())
+        for _ in range(MAX_CONCURRENCY_CAP):
+            self.add_behaviour(self.Worker())
+
+    async def stop(self):
+        await super().stop()
+        await self.ai.aclose()
+        self.ai_executor.shutdown(wait=False, cancel_futures=True)
 
 # ====== MAIN ======
 async def main():
@@ -779,4 +1238,12 @@ async def main():
         pass
 
 if __name__ == "__main__":
+    # uvloop (libuv) – szybsza pętla zdarzeń; opcjonalnie (brak pakietu / Windows → domyślna pętla asyncio)
+    if _env_int("COORD_UVLOOP", 1):
+        try:
+            import uvloop  # pip install uvloop
+            uvloop.install()
+            log.info("Pętla zdarzeń: uvloop")
+        except ImportError:
+            pass
     asyncio.run(main())
@@ -7,10 +7,11 @@
 # - Rejestr oczekiwań na INFORM.PRESENTER_REPLY od Koordynatora (in_reply_to = reply_with)
 
 import os
-import json
+import sys
 import time
 import asyncio
-from typing import Dict, Any, Optional
+import logging
+from typing import Dict, Any, Optional, Tuple
 
 from spade.agent import Agent
 from spade.message import Message
@@ -37,6 +38,9 @@ COORD_JID       = _env("COORDINATOR_JID", "COORD_JID", default="coordinator@xmpp
 REQ_TIMEOUT_S   = int(_env("PRESENTER_TIMEOUT", default="15") or "15")
 CONV_GRACE_SEC  = float(_env("PRESENTER_CONV_GRACE_SEC", default="0.5") or "0.5")
 MAX_CONCURRENCY = int(_env("PRESENTER_MAX_CONCURRENCY", default="5") or "5")
+RECV_TIMEOUT_S  = float(_env("PRESENTER_RECV_TIMEOUT", default="0") or "0")  # Dispatcher: 0 = czekaj bez budzenia
+# 1: ramki Koordynatora prosto z codec (orjson); 0: najpierw normalizacja przez model AclMessage (pydantic)
+FAST_ACL        = (_env("PRESENTER_FAST_ACL", default="1") or "1") == "1"
 
 # Tryb pracy
 QUESTION_ONESHOT = _env("PRESENTER_QUESTION", "QUESTION", default=None)
@@ -45,18 +49,39 @@ CONV_ID_ONESHOT  = _env("PRESENTER_CONV_ID", "CONV_ID", default=None)
 # Możliwość narzucenia ID sesji z ENV (np. frontend)
 SESSION_ID_ENV   = _env("PRESENTER_SESSION_ID", "PRESENTER_CONV_ID", "CONV_ID", default=None)
 
+LOG_LEVEL        = (_env("PRESENTER_LOG_LEVEL", default="INFO") or "INFO").upper()
+
+def _setup_logging() -> logging.Logger:
+    """Logger "pres" w formacie dawnych print(): "[PRES] 2025-01-01T12:00:00Z ..."; formatowanie tylko, gdy poziom przepuszcza."""
+    lg = logging.getLogger("pres")
+    if not lg.handlers:
+        out = logging.StreamHandler(sys.stdout)
+        fmt = logging.Formatter("[PRES] %(asctime)s %(message)s", datefmt="%Y-%m-%dT%H:%M:%SZ")
+        fmt.converter = time.gmtime
+        out.setFormatter(fmt)
+        lg.addHandler(out)
+        lg.propagate = False
+    lg.setLevel(LOG_LEVEL if LOG_LEVEL in logging.getLevelNamesMapping() else "INFO")
+    return lg
+
+log = _setup_logging()
+
 # ====== PROTOKOŁ (wzorcówka) ======
 from firststage.protocol.acl_messages import (
-    AclMessage, make_acl, new_reply_id, now_iso
+    AclMessage, AclTemplate, new_reply_id
 )
+from firststage.protocol import codec
 from firststage.protocol.correlation import CorrBook
 from firststage.protocol.guards import allow_if_correlated, bare as bare_jid
 
 def parse_acl(body: str) -> Dict[str, Any]:
+    if FAST_ACL:
+        return codec.loads(body or "{}")
+    # Walidacja tylko normalizuje: ramka niezgodna z modelem i tak przechodzi jako surowy JSON
     try:
         return AclMessage.loads(body).model_dump()
     except Exception:
-        return json.loads(body or "{}")
+        return codec.loads(body or "{}")
 
 # ====== AGENT ======
 class PresenterAgent(Agent):
@@ -70,9 +95,13 @@ class PresenterAgent(Agent):
 
     def __init__(self, jid: str, password: str, *args, **kwargs):
         super().__init__(jid, password, *args, **kwargs)
-        self.conv_queues: Dict[str, asyncio.Queue] = {}
+        # Jedyna oczekująca rozmowa (session_lock: jeden dialog naraz): (conv_id, Future z tekstem PRESENTER_REPLY)
+        self.waiting: Optional[Tuple[str, asyncio.Future]] = None
         self.sem = asyncio.Semaphore(MAX_CONCURRENCY)
         self.coordinator_jid = COORD_JID
+        # bare JID Koordynatora stały na sesję – Dyspozytor porównuje z nim bez split() na każdej ramce
+        self.coord_bare = bare_jid(COORD_JID)
+        self._coord_prefix = self.coord_bare + "/"
         self.session_lock = asyncio.Lock()
         self.corr = CorrBook(ttl_sec=REQ_TIMEOUT_S + 2.0)  # księga korelacji
         # self.session_id ustawimy w setup()
@@ -80,15 +109,45 @@ class PresenterAgent(Agent):
     # ---------- Behawiory ----------
     class Dispatcher(CyclicBehaviour):
         """Globalny odbiornik: filtruje i kieruje ramki wg conversation_id z korelacją (punkt 8)."""
+        def kill(self, exit_code: Optional[Any] = None) -> None:
+            super().kill(exit_code)
+            # receive()/queue.get() czeka na ramkę – wybudź go, żeby stop agenta nie wisiał
+            self.queue.put_nowait(None)
+
         async def run(self):
-            msg = await self.receive(timeout=1)
+            if RECV_TIMEOUT_S > 0:
+                msg = await self.receive(timeout=RECV_TIMEOUT_S)
+            else:
+                # receive(timeout=None) w SPADE nie czeka (get_nowait) – czekamy wprost na kolejce behawioru;
+                # kill() wrzuca None, więc stop agenta i tak ją budzi
+                msg = await self.queue.get()
             if not msg:
                 return
 
+            # Najpierw tanie filtry bez parsowania body: nadawca (tylko Koordynator) i metadana "conv"
+            sender = str(msg.sender)
+            if sender != self.agent.coord_bare and not sender.startswith(self.agent._coord_prefix):
+                log.warning("DROP from=%s (nie Koordynator)", bare_jid(sender))
+                return
+            waiting = self.agent.waiting
+            if waiting is None or waiting[1].done():
+                # Spóźnione ramki po domknięciu rozmowy – pomiń po cichu
+                return
+            meta_conv = msg.get_metadata("conv")
+            if meta_conv and meta_conv != waiting[0]:
+                return
+            # Korelacja z metadanych (Koordynator podaje in_reply_to) – body tylko dla przyjętej ramki
+            meta_irt = msg.get_metadata("in_reply_to")
+            meta_pf = msg.get_metadata("performative")
+            if meta_irt and not self.agent.corr.match_and_pop(
+                    waiting[0], meta_irt, from_bare=self.agent.coord_bare, performative=meta_pf):
+                log.warning("DROP (meta) pf=%s from=%s conv=%s irt=%s", meta_pf, self.agent.coord_bare, meta_conv, meta_irt)
+                return
+
             try:
                 acl = parse_acl(msg.body)
             except Exception as e:
-                print(f"[PRES] {now_iso()} Odrzucono nie-JSON od {msg.sender}: {e}")
+                log.warning("Odrzucono nie-JSON od %s: %s", msg.sender, e)
                 return
 
             pf   = acl.get("performative")
@@ -97,21 +156,26 @@ class PresenterAgent(Agent):
             conv = acl.get("conversation_id")
 
             if not conv:
-                print(f"[PRES] {now_iso()} Ignoruję ramkę bez conversation_id pf={pf} typ={typ} od {msg.sender}")
+                log.info("Ignoruję ramkę bez conversation_id pf=%s typ=%s od %s", pf, typ, msg.sender)
                 return
 
-            # Strażnik korelacji: przyjmujemy tylko to, na co czekamy (od Koordynatora, po in_reply_to)
-            from_bare = bare_jid(str(msg.sender))
-            if not allow_if_correlated(self.agent.corr, acl, from_bare=from_bare):
-                print(f"[PRES] {now_iso()} DROP pf={pf} from={from_bare} conv={conv} irt={acl.get('in_reply_to')}")
+            # Strażnik korelacji z body, gdy ramka nie niosła in_reply_to w metadanych
+            if not meta_irt and not allow_if_correlated(self.agent.corr, acl, from_bare=self.agent.coord_bare):
+                log.warning("DROP pf=%s from=%s conv=%s irt=%s", pf, self.agent.coord_bare, conv, acl.get("in_reply_to"))
                 return
 
-            q = self.agent.conv_queues.get(conv)
-            if q:
-                await q.put(msg)
+            if conv != waiting[0]:
+                return
+            fut = waiting[1]
+
+            if pf == "INFORM" and typ == "PRESENTER_REPLY":
+                fut.set_result(cont.get("text") or "")
+            elif pf in ("REFUSE", "FAILURE", "NOT-UNDERSTOOD"):
+                # Inne dopuszczalne PF – pokaż ślad dla operatora; rozmowa czeka dalej,
+                # bo niektóre implementacje wyślą jeszcze INFORM
+                log.info("[CONV %s] pf=%s typ=%s payload=%s", conv, pf, typ, codec.dumps(cont))
             else:
-                # Spóźnione ramki po domknięciu rozmowy – pomiń po cichu
-                pass
+                log.info("[CONV %s] niespodziewane pf=%s typ=%s", conv, pf, typ)
 
     class ServeConversation(OneShotBehaviour):
         """Jedna interakcja w obrębie tej samej sesji (self.agent.session_id)."""
@@ -126,79 +190,55 @@ class PresenterAgent(Agent):
             msg = Message(to=self.agent.coordinator_jid)
             msg.set_metadata("conv", self.conv_id)
             msg.set_metadata("performative", "REQUEST")
-            msg.body = make_acl(
-                "REQUEST", "Presenter", "Coordinator",
+            msg.set_metadata("reply_with", reply_id)
+            msg.body = self.agent.user_msg_tpl.render(
+                conversation_id=self.conv_id,
+                reply_with=reply_id,
                 content={
                     "type": "USER_MSG",
                     "args": {"question": self.question},
-                    "meta": {"presenter_jid": str(self.agent.jid)}
+                    "meta": self.agent.user_msg_meta,
                 },
-                conversation_id=self.conv_id,
-                reply_with=reply_id,
-                protocol="fipa-request",
             )
 
-            # Zarejestruj oczekiwanie: INFORM (preferowane) + dopuszczalnie REFUSE/FAILURE/NOT-UNDERSTOOD
+            # Zarejestruj oczekiwanie: INFORM (preferowane) + dopuszczalnie REFUSE/FAILURE/NOT-UNDERSTOOD;
+            # konsumuje tylko INFORM – po REFUSE/FAILURE ten sam reply_with może jeszcze przynieść odpowiedź
             self.agent.corr.register(
                 self.conv_id, reply_id,
-                allow_from=[bare_jid(self.agent.coordinator_jid)],
+                allow_from=[self.agent.coord_bare],
                 allow_pf=["INFORM", "REFUSE", "FAILURE", "NOT-UNDERSTOOD"],
+                consume_on=["INFORM"],
                 note="PRES REQUEST.USER_MSG → oczekuję INFORM.PRESENTER_REPLY"
             )
 
-            print(f"[PRES] {now_iso()} → COORD {self.agent.coordinator_jid} REQUEST.USER_MSG conv={self.conv_id} q={self.question!r}")
+            log.info("→ COORD %s REQUEST.USER_MSG conv=%s q=%r", self.agent.coordinator_jid, self.conv_id, self.question)
             await self.send(msg)
             return reply_id
 
-        async def wait_for_reply(self) -> Optional[str]:
-            q: asyncio.Queue = self.agent.conv_queues[self.conv_id]
-            deadline = time.time() + REQ_TIMEOUT_S
-            while time.time() < deadline:
-                remain = max(0, deadline - time.time())
-                try:
-                    m: Message = await asyncio.wait_for(q.get(), timeout=min(remain, 1.0))
-                except asyncio.TimeoutError:
-                    continue
-
-                try:
-                    acl = parse_acl(m.body)
-                except Exception as e:
-                    print(f"[PRES] {now_iso()} Odrzucono nie-JSON ({e}) od {m.sender}")
-                    continue
-
-                if acl.get("conversation_id") != self.conv_id:
-                    continue
-
-                pf = acl.get("performative")
-                cont = acl.get("content") or {}
-                typ = (cont.get("type") or "").upper()
-
-                if pf == "INFORM" and typ == "PRESENTER_REPLY":
-                    text = cont.get("text") or ""
-                    print(f"[PRES] {now_iso()} ← COORD INFORM.PRESENTER_REPLY conv={self.conv_id} text={text!r}")
-                    return text
-
-                # Inne dopuszczalne PF – pokaż ślad dla operatora
-                if pf in ("REFUSE", "FAILURE", "NOT-UNDERSTOOD"):
-                    print(f"[PRES] {now_iso()} [CONV {self.conv_id}] pf={pf} typ={typ} payload={json.dumps(cont, ensure_ascii=False)}")
-                    # czekamy dalej do timeoutu, bo niektóre implementacje wyślą jeszcze INFORM
-
-                else:
-                    print(f"[PRES] {now_iso()} [CONV {self.conv_id}] niespodziewane pf={pf} typ={typ}")
+        async def wait_for_reply(self, fut: asyncio.Future) -> Optional[str]:
+            # Dyspozytor rozstrzyga Future od razu po PRESENTER_REPLY – jedno czekanie z terminem
+            try:
+                text = await asyncio.wait_for(fut, REQ_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                log.info("← COORD INFORM.PRESENTER_REPLY conv=%s text=%r", self.conv_id, text)
+                return text
 
-            print(f"[PRES] {now_iso()} [CONV {self.conv_id}] timeout po {REQ_TIMEOUT_S}s – brak PRESENTER_REPLY. "
-                  f"Sugestia: sprawdź czy Koordynator działa i ma poprawny JID ({self.agent.coordinator_jid}).")
+            log.warning("[CONV %s] timeout po %ss – brak PRESENTER_REPLY. "
+                        "Sugestia: sprawdź czy Koordynator działa i ma poprawny JID (%s).",
+                        self.conv_id, REQ_TIMEOUT_S, self.agent.coordinator_jid)
             return None
 
         async def run(self):
             # JEDEN dialog na raz w ramach JEDNEJ sesji (jedno conversation_id)
             async with self.agent.session_lock:
-                if self.conv_id not in self.agent.conv_queues:
-                    self.agent.conv_queues[self.conv_id] = asyncio.Queue()
-                print(f"[PRES] {now_iso()} [CONV {self.conv_id}] start")
+                fut = asyncio.get_running_loop().create_future()
+                self.agent.waiting = (self.conv_id, fut)
+                log.info("[CONV %s] start", self.conv_id)
                 try:
                     await self.send_user_msg()
-                    text = await self.wait_for_reply()
+                    text = await self.wait_for_reply(fut)
                     if text is not None:
                         print(f"[PRES] Odpowiedź: {text}")
                     else:
@@ -206,20 +246,17 @@ class PresenterAgent(Agent):
                 finally:
                     if CONV_GRACE_SEC > 0:
                         await asyncio.sleep(CONV_GRACE_SEC)
-                    try:
-                        q = self.agent.conv_queues.pop(self.conv_id, None)
-                        if q:
-                            while not q.empty():
-                                _ = q.get_nowait()
-                    except Exception:
-                        pass
-                    print(f"[PRES] {now_iso()} [CONV {self.conv_id}] koniec")
+                    self.agent.waiting = None
+                    log.info("[CONV %s] koniec", self.conv_id)
 
     async def setup(self):
         # Ustal stałe ID sesji: z ENV lub jednorazowo z zegara
-        self.session_id = SESSION_ID_ENV or f"sess-pres-{int(time.time()*1000)}"
-        print(f"[PRES] Start jako {self.jid}. COORD={self.coordinator_jid} TIMEOUT={REQ_TIMEOUT_S}s "
-              f"MODE={'ONESHOT' if QUESTION_ONESHOT else 'REPL'} SESSION_ID={self.session_id}")
+        self.session_id = SESSION_ID_ENV or new_reply_id("sess-pres")
+        # Koperta USER_MSG walidowana i serializowana raz; przy wysyłce tylko ID, timestamp i content
+        self.user_msg_tpl = AclTemplate("REQUEST", "Presenter", "Coordinator", protocol="fipa-request")
+        self.user_msg_meta = {"presenter_jid": str(self.jid)}
+        log.info("Start jako %s. COORD=%s TIMEOUT=%ss MODE=%s SESSION_ID=%s", self.jid, self.coordinator_jid,
+                 REQ_TIMEOUT_S, "ONESHOT" if QUESTION_ONESHOT else "REPL", self.session_id)
         self.add_behaviour(self.Dispatcher())
 
 # ====== uruchomienie ======
@@ -4,7 +4,6 @@
 # In-memory; po staremu – QUERY-REF potrafi zwrócić pełne profile.
 
 import os
-import json
 import time
 import copy
 import asyncio
@@ -26,6 +25,9 @@ from spade.agent import Agent
 from spade.behaviour import CyclicBehaviour
 from spade.message import Message
 
+from firststage.protocol import codec
+from firststage.protocol.acl_messages import now_iso  # znacznik ISO liczony raz na sekundę
+
 # --- ENV ---
 def _env(name: str, default: Optional[str] = None) -> Optional[str]:
     v = os.getenv(name)
@@ -40,9 +42,6 @@ CLEANUP_PERIOD  = int(_env("DF_CLEANUP_PERIOD", "10"))
 DF_DEBUG        = (_env("DF_DEBUG", "0") == "1")  # proste logi diagnostyczne
 
 # --- ACL helpers ---
-def now_iso() -> str:
-    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-
 def make_acl(
     performative: str,
     sender: str,
@@ -53,7 +52,7 @@ def make_acl(
     in_reply_to: Optional[str] = None,
 ) -> str:
     prot = "fipa-query" if performative == "QUERY-REF" else "fipa-request"
-    return json.dumps({
+    return codec.dumps({
         "performative": performative,
         "sender": sender,
         "receiver": receiver,
@@ -65,11 +64,19 @@ def make_acl(
         "reply_with": reply_with,
         "in_reply_to": in_reply_to,
         "content": content
-    }, ensure_ascii=False)
+    })
+
+def _set_reply_meta(msg: Message, performative: str, acl: Dict[str, Any]) -> None:
+    """Metadane XMPP odpowiedzi (conv / in_reply_to / performative) – odbiorca routuje bez parsowania body."""
+    msg.set_metadata("performative", performative)
+    if acl.get("conversation_id"):
+        msg.set_metadata("conv", str(acl["conversation_id"]))
+    if acl.get("reply_with"):
+        msg.set_metadata("in_reply_to", str(acl["reply_with"]))
 
 def parse_acl(body: str) -> Dict[str, Any]:
     try:
-        return json.loads(body or "{}")
+        return codec.loads(body or "{}")
     except Exception:
         return {}
 
@@ -161,17 +168,25 @@ class RegistryAgent(Agent):
         return copy.deepcopy(self.catalog.get(jid, {"jid": jid}))
 
     class DFBehaviour(CyclicBehaviour):
+        def kill(self, exit_code: Optional[Any] = None) -> None:
+            super().kill(exit_code)
+            # receive() czeka do kolejnego sprzątania – wybudź go, żeby stop agenta nie wisiał
+            self.queue.put_nowait(None)
+
         async def on_start(self):
-            self.agent._last_cleanup = 0.0
+            # zegar monotoniczny – harmonogram GC odporny na skoki czasu (NTP)
+            self.agent._last_cleanup = time.monotonic()
             print(f"[DF] Registry started as {self.agent.jid}. HB={HEARTBEAT_SEC}s TTLx{TTL_MULTIPLIER} GC={CLEANUP_PERIOD}s")
 
         async def run(self):
             # sprzątanie okresowe
-            if time.time() - self.agent._last_cleanup > CLEANUP_PERIOD:
+            if time.monotonic() - self.agent._last_cleanup > CLEANUP_PERIOD:
                 self.agent._gc()
-                self.agent._last_cleanup = time.time()
+                self.agent._last_cleanup = time.monotonic()
 
-            msg = await self.receive(timeout=1)
+            # czekamy najwyżej do kolejnego sprzątania (zamiast budzić się co 1 s)
+            wait = CLEANUP_PERIOD - (time.monotonic() - self.agent._last_cleanup)
+            msg = await self.receive(timeout=max(0.05, wait))
             if not msg:
                 return
 
@@ -188,6 +203,7 @@ class RegistryAgent(Agent):
                 profile = c.get("profile", {}) or {}
                 if "jid" not in profile:
                     nack = Message(to=str(msg.sender))
+                    _set_reply_meta(nack, "FAILURE", acl)
                     nack.body = make_acl(
                         "FAILURE", "Registry", "Unknown",
                         content={"reason": "INVALID_PROFILE"},
@@ -199,6 +215,7 @@ class RegistryAgent(Agent):
                 self.agent._upsert_profile(profile)
                 print(f"[DF] REGISTER: {profile['jid']} caps={profile.get('capabilities', [])}")
                 ack = Message(to=str(msg.sender))
+                _set_reply_meta(ack, "AGREE", acl)
                 ack.body = make_acl(
                     "AGREE", "Registry", acl.get("sender", "Unknown"),
                     content={"status": "registered"},
@@ -223,6 +240,7 @@ class RegistryAgent(Agent):
                     self.agent._remove(jid, reason="deregister")
                     print(f"[DF] DEREGISTER: {jid}")
                     ack = Message(to=str(msg.sender))
+                    _set_reply_meta(ack, "AGREE", acl)
                     ack.body = make_acl(
                         "AGREE", "Registry", acl.get("sender", "Unknown"),
                         content={"status": "deregistered"},
@@ -254,6 +272,7 @@ class RegistryAgent(Agent):
                     if DF_DEBUG:
                         print(f"[DF] QUERY LIST → {len(profiles)} live profiles")
                     ans = Message(to=str(msg.sender))
+                    _set_reply_meta(ans, "INFORM", acl)
                     ans.body = make_acl(
                         "INFORM", "Registry", acl.get("sender", "Unknown"),
                         content={
@@ -273,6 +292,7 @@ class RegistryAgent(Agent):
                     if DF_DEBUG:
                         print(f"[DF] QUERY DUMP → {len(profiles)} total profiles")
                     ans = Message(to=str(msg.sender))
+                    _set_reply_meta(ans, "INFORM", acl)
                     ans.body = make_acl(
                         "INFORM", "Registry", acl.get("sender", "Unknown"),
                         content={
@@ -293,6 +313,7 @@ class RegistryAgent(Agent):
                     if DF_DEBUG:
                         print(f"[DF] QUERY need={need_raw!r} (ALL/*) → {len(profiles)} live profiles")
                     ans = Message(to=str(msg.sender))
+                    _set_reply_meta(ans, "INFORM", acl)
                     ans.body = make_acl(
                         "INFORM", "Registry", acl.get("sender", "Unknown"),
                         content={
@@ -324,6 +345,7 @@ class RegistryAgent(Agent):
                         print(f"[DF] QUERY need={need_raw!r} → match={len(alive)} (live)")
 
                     ans = Message(to=str(msg.sender))
+                    _set_reply_meta(ans, "INFORM", acl)
                     ans.body = make_acl(
                         "INFORM", "Registry", acl.get("sender", "Unknown"),
                         content={"candidates": alive, "profiles": profiles, "df_timestamp": now_iso()},
@@ -13,11 +13,9 @@ SPEC_DESC_PATH (plik) > SPEC_DESC_B64 (base64) > SPEC_DESC (tekst z \n) > SPEC_D
 """
 
 import os
-import json
-import time
 import base64
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # --- dotenv (opcjonalnie) ---
 try:
@@ -34,6 +32,9 @@ from spade.agent import Agent
 from spade.behaviour import CyclicBehaviour, PeriodicBehaviour, OneShotBehaviour
 from spade.message import Message
 
+from firststage.protocol import codec
+from firststage.protocol.acl_messages import new_reply_id, now_iso  # ISO liczony raz na sekundę; ID z licznika
+
 # ====== OPIS W KODZIE (fallback) ======
 SPEC_DESC_CODE = """\
 Agent specjalistyczny odpowiedzialny za capability ASK_EXPERT.
@@ -96,15 +97,13 @@ AGENT_PASS   = _first_env("SPECIALIST_PASS", "AGENT_PASS", "XMPP_PASS")
 REGISTRY_JID = _first_env("REGISTRY_JID", "DF_JID", default="registry@xmpp.pawelhaladyj.pl")
 
 HEARTBEAT_S  = int(_first_env("SPEC_HEARTBEAT_SEC", "HEARTBEAT_SEC", default="30") or "30")
+RECV_TIMEOUT_S = float(_first_env("SPEC_RECV_TIMEOUT", default="30") or "30")  # ServeBehaviour: bez budzenia co 1 s
 NAME         = _first_env("SPEC_NAME", default="Specialist") or "Specialist"
 VERSION      = _first_env("SPEC_VERSION", default="1.0.0") or "1.0.0"
 DESC         = _load_description(SPEC_DESC_CODE)
 CAP          = "ASK_EXPERT"
 
 # ====== ACL helpers ======
-def now_iso() -> str:
-    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-
 def make_acl(
     performative: str,
     sender: str,
@@ -116,7 +115,7 @@ def make_acl(
     protocol: str | None = None
 ) -> str:
     prot = protocol or ("fipa-query" if performative == "QUERY-REF" else "fipa-request")
-    return json.dumps({
+    return codec.dumps({
         "performative": performative,
         "sender": sender,
         "receiver": receiver,
@@ -130,16 +129,24 @@ def make_acl(
         "content": content
     })
 
+def _set_reply_meta(msg: Message, performative: str, conv: str | None, in_reply_to: str | None) -> None:
+    """Metadane XMPP odpowiedzi – Koordynator routuje po nich bez parsowania body."""
+    msg.set_metadata("performative", performative)
+    if conv:
+        msg.set_metadata("conv", str(conv))
+    if in_reply_to:
+        msg.set_metadata("in_reply_to", str(in_reply_to))
+
 def parse_acl(body: str) -> Dict[str, Any]:
-    return json.loads(body or "{}")
+    return codec.loads(body or "{}")
 
 # ====== AGENT ======
 class SpecialistAgent(Agent):
 
     class RegisterBehaviour(OneShotBehaviour):
         async def run(self):
-            conv_id = f"sess-{int(time.time())}"
-            reply_id = f"msg-{int(time.time()*1000)}"
+            conv_id = new_reply_id("sess")
+            reply_id = new_reply_id("msg")
             jid_bare = _bare(str(self.agent.jid))
 
             # REGISTER
@@ -174,8 +181,13 @@ class SpecialistAgent(Agent):
             print(f"[SPEC] Description (first 120 chars): {DESC[:120].replace(os.linesep, ' ')}{'...' if len(DESC) > 120 else ''}")
 
     class ServeBehaviour(CyclicBehaviour):
+        def kill(self, exit_code: Optional[Any] = None) -> None:
+            super().kill(exit_code)
+            # receive() czeka do RECV_TIMEOUT_S – wybudź go, żeby stop agenta nie wisiał
+            self.queue.put_nowait(None)
+
         async def run(self):
-            msg = await self.receive(timeout=1)
+            msg = await self.receive(timeout=RECV_TIMEOUT_S)
             if not msg:
                 return
             try:
@@ -193,6 +205,7 @@ class SpecialistAgent(Agent):
 
                 # 1) AGREE
                 agree = Message(to=str(msg.sender))
+                _set_reply_meta(agree, "AGREE", conv, req_id)
                 agree.body = make_acl(
                     "AGREE", NAME, "Coordinator",
                     content={"status": "accepted"},
@@ -208,6 +221,7 @@ class SpecialistAgent(Agent):
 
                 # 3) INFORM.RESULT
                 res = Message(to=str(msg.sender))
+                _set_reply_meta(res, "INFORM", conv, req_id)
                 res.body = make_acl(
                     "INFORM", NAME, "Coordinator",
                     content={"type": "RESULT",
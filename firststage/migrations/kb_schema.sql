@@ -13,6 +13,11 @@ created_by text NOT NULL,
 deleted boolean NOT NULL DEFAULT false
 );
 CREATE UNIQUE INDEX IF NOT EXISTS kb_items_key_version_uq ON kb_items(key, version);
-CREATE INDEX IF NOT EXISTS kb_items_key_desc_idx ON kb_items(key, version DESC);
+-- Odczyty (GET latest/as_of, ogon timeline) filtrują deleted=false: indeksy częściowe tylko z żywymi wierszami.
+-- MAX(version) przy zapisie (bez filtra deleted) obsługuje unikalny (key, version).
+CREATE INDEX IF NOT EXISTS kb_items_live_key_ver ON kb_items(key, version DESC) WHERE deleted = false;
+CREATE INDEX IF NOT EXISTS kb_items_live_key_created ON kb_items(key, created_at DESC) WHERE deleted = false;
+DROP INDEX IF EXISTS kb_items_key_desc_idx;
 CREATE INDEX IF NOT EXISTS kb_items_session_idx ON kb_items(session_id);
-CREATE INDEX IF NOT EXISTS kb_items_tags_gin ON kb_items USING GIN (tags);
\ No newline at end of file
+-- tags tylko zapisujemy (żadne zapytanie po nich nie filtruje) – GIN podrażał każdy INSERT
+DROP INDEX IF EXISTS kb_items_tags_gin;
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import json
+import itertools
 import re
 import time
 import uuid
@@ -9,13 +9,44 @@ from typing import Any, Dict, Literal, Optional, Set
 
 from pydantic import BaseModel, Field, field_validator, model_validator
 
+from firststage.protocol import codec
+
+
+class _Clock:
+    """Znacznik ISO z rozdzielczością sekundy – formatujemy raz na sekundę, nie przy każdym wywołaniu."""
+    __slots__ = ("t", "s")
+
+    def __init__(self) -> None:
+        self.t = -1
+        self.s = ""
+
+    def iso(self) -> str:
+        n = time.time_ns() // 1_000_000_000
+        if n != self.t:
+            self.s = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(n))
+            self.t = n
+        return self.s
+
+
+_CLOCK = _Clock()
+
 
 def now_iso() -> str:
-    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return _CLOCK.iso()
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+# Unikalność ID: znacznik ms + sól procesu (raz na start) + licznik (next() na count jest atomowe w pętli asyncio).
+# Bez uuid4 na każde ID; dwie rozmowy w tej samej milisekundzie dostają różne numery.
+_RUN = uuid.uuid4().hex[:6]
+_SEQ = itertools.count(1)
 
 
 def new_reply_id(prefix: str = "msg") -> str:
-    return f"{prefix}-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    return f"{prefix}-{now_ms()}-{_RUN}{next(_SEQ):x}"
 
 
 VALID_PERFORMATIVES: Set[str] = {
@@ -130,11 +161,12 @@ class AclMessage(BaseModel):
 
     def dumps(self) -> str:
         # Pydantic v2: używamy model_dump()
-        return json.dumps(self.model_dump(), ensure_ascii=False)
+        return codec.dumps(self.model_dump())
 
     @staticmethod
     def loads(body: str) -> "AclMessage":
-        return AclMessage(**json.loads(body or "{}"))
+        # Jeden przebieg (pydantic-core): parse JSON + walidacja, bez pośredniego dict
+        return AclMessage.model_validate_json(body or "{}")
 
 
 def make_acl(
@@ -150,17 +182,58 @@ def make_acl(
     ontology: Optional[str] = None,
     language: Optional[str] = None,
 ) -> str:
-    pf_norm = normalize_performative(performative)
-    msg = AclMessage(
-        performative=pf_norm,
-        sender=sender,
-        receiver=receiver,
-        ontology=ontology or "MAS.Core",
-        protocol=protocol or default_protocol_for(pf_norm),
-        language=language or "application/json",
-        content=content,
-        conversation_id=conversation_id,
-        reply_with=reply_with,
-        in_reply_to=in_reply_to,
-    )
-    return msg.dumps()
+    """
+    Ramka ACL jako str JSON – ten sam kształt i kolejność pól co AclMessage.dumps(),
+    ale bez budowy modelu pydantic: walidujemy tylko to, co może być błędne (performative, content).
+    """
+    pf_norm = performative if performative in VALID_PERFORMATIVES else normalize_performative(performative)
+    if pf_norm not in VALID_PERFORMATIVES:
+        raise ValueError(f"Unknown performative: {performative!r}")
+    if not isinstance(content, dict):
+        raise ValueError("content musi być obiektem (dict)")
+    return codec.dumps({
+        "performative": pf_norm,
+        "sender": sender,
+        "receiver": receiver,
+        "ontology": ontology or "MAS.Core",
+        "protocol": protocol or default_protocol_for(pf_norm),
+        "language": language or "application/json",
+        "timestamp": now_iso(),
+        "conversation_id": conversation_id,
+        "reply_with": reply_with,
+        "in_reply_to": in_reply_to,
+        "content": content,
+    })
+
+
+_HEAD_KEYS = ("performative", "sender", "receiver", "ontology", "protocol", "language")
+
+
+def _jstr(v: Optional[str]) -> str:
+    return "null" if v is None else codec.dumps(v)
+
+
+class AclTemplate:
+    """
+    Stała część ramki ACL walidowana RAZ (make_acl) i zserializowana RAZ do fragmentów JSON;
+    render() skleja je z polami zmiennymi (timestamp, conversation_id, reply_with, opcjonalnie content).
+    Serializowane przy wysyłce są tylko ID i content – wynik równoważny make_acl().
+    """
+    __slots__ = ("_head", "_tail", "_content")
+
+    def __init__(self, performative: str, sender: str, receiver: str, *,
+                 content: Optional[Dict[str, Any]] = None, **kw: Any) -> None:
+        base = codec.loads(make_acl(performative, sender, receiver, content=content or {}, **kw))
+        # '{"performative":...,"language":...' bez zamykającej klamry
+        self._head: str = codec.dumps({k: base[k] for k in _HEAD_KEYS})[:-1] + ',"timestamp":"'
+        self._tail: str = ',"in_reply_to":' + _jstr(base.get("in_reply_to")) + ',"content":'
+        self._content: str = codec.dumps(base["content"])
+
+    def render(self, *, conversation_id: Optional[str] = None, reply_with: Optional[str] = None,
+               content: Optional[Dict[str, Any]] = None) -> str:
+        return "".join((
+            self._head, now_iso(),
+            '","conversation_id":', _jstr(conversation_id),
+            ',"reply_with":', _jstr(reply_with),
+            self._tail, self._content if content is None else codec.dumps(content), "}",
+        ))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Kodek JSON dla ramek ACL/KB (gorąca ścieżka make_acl/parse_acl).
+# orjson, jeśli jest zainstalowany (pip install orjson); w przeciwnym razie stdlib json.
+# Opcjonalnie MessagePack (pip install msgspec) dla ruchu wewnątrz MAS (Koordynator <-> KB):
+# body = base64(msgpack), a w metadanych XMPP "encoding" = "mp+b64".
+from __future__ import annotations
+
+import json
+import base64
+from typing import Any, Optional, Union
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # fallback na stdlib
+
+try:
+    import msgspec  # type: ignore
+except Exception:
+    msgspec = None  # MessagePack niedostępny → tylko JSON
+
+Body = Union[str, bytes, bytearray, memoryview]
+
+# Metadane XMPP opisujące kodowanie body
+ENCODING_META = "encoding"
+ENC_JSON = "json"
+ENC_MSGPACK_B64 = "mp+b64"
+
+_MP_ENC = msgspec.msgpack.Encoder() if msgspec is not None else None
+_MP_DEC = msgspec.msgpack.Decoder() if msgspec is not None else None
+
+
+def dumps(obj: Any) -> str:
+    """Serializacja do str (body wiadomości XMPP musi być tekstem). UTF-8 bez escapowania."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def dumpb(obj: Any) -> bytes:
+    """Jak dumps(), ale bajty UTF-8 – dla odbiorców przyjmujących bytes (np. jsonb binarnie w asyncpg)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def loads(body: Body) -> Any:
+    """Parsowanie str/bytes → obiekt Pythona. Błędy zgłaszane jako ValueError (jak json.loads)."""
+    if orjson is not None:
+        return orjson.loads(body)
+    if isinstance(body, memoryview):
+        body = body.tobytes()
+    return json.loads(body)
+
+
+def msgpack_available() -> bool:
+    return _MP_ENC is not None
+
+
+def encode_body(obj: Any, encoding: Optional[str] = None) -> str:
+    """Body wiadomości w zadanym kodowaniu (domyślnie JSON)."""
+    if encoding == ENC_MSGPACK_B64:
+        if _MP_ENC is None:
+            raise RuntimeError("Kodowanie mp+b64 wymaga biblioteki 'msgspec' (pip install msgspec).")
+        return base64.b64encode(_MP_ENC.encode(obj)).decode("ascii")
+    return dumps(obj)
+
+
+def decode_body(body: Body, encoding: Optional[str] = None) -> Any:
+    """Odwrotność encode_body; nieznane/puste kodowanie → JSON (ścieżka zgodna wstecz)."""
+    if encoding == ENC_MSGPACK_B64:
+        if _MP_DEC is None:
+            raise ValueError("Ramka mp+b64, a 'msgspec' nie jest zainstalowany.")
+        try:
+            return _MP_DEC.decode(base64.b64decode(body, validate=True))
+        except Exception as e:
+            raise ValueError(f"Niepoprawna ramka mp+b64: {e}") from e
+    return loads(body)
@@ -2,7 +2,8 @@
 from __future__ import annotations
 
 import time
-from typing import Dict, List, Optional, Set
+import heapq
+from typing import Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass
 
 # PF-y traktowane jako „ack” (nie powinny konsumować oczekiwania przy scenariuszu wieloetapowym)
@@ -30,11 +31,14 @@ class CorrBook:
       Konsumpcja (pop) zależy od polityki consume_on / heurystyki ACK.
     - Jeżeli nie pasuje albo wygasł → False (wygasły także usuwamy).
     - Gdy kubełek konwersacji się opróżni, czyścimy go z mapy.
+    - Wygasłe wpisy, na które nikt nie odpowiedział, zdejmuje kopiec terminów (min-heap po expires_at)
+      przy register/match_and_pop – koszt O(log n) na wpis zamiast skanu całej księgi.
     """
 
     def __init__(self, ttl_sec: float = 30.0):
         self.ttl = float(ttl_sec)
         self._by_conv: Dict[str, Dict[str, Expectation]] = {}
+        self._expiry: List[Tuple[float, str, str]] = []  # (expires_at, conv_id, reply_with)
 
     # API
     # ---
@@ -48,6 +52,7 @@ class CorrBook:
         allow_pf: Optional[List[str]] = None,
         ttl_sec: Optional[float] = None,
         note: str = "",
+        consume_on: Optional[List[str]] = None,
     ) -> None:
         """
         Zarejestruj oczekiwanie na ramkę zwrotną identyfikowaną przez (conv_id, reply_with).
@@ -58,24 +63,30 @@ class CorrBook:
         :param allow_pf: lista dopuszczalnych performatywów (case-insensitive; pusta → dowolny)
         :param ttl_sec: czas życia wpisu
         :param note: opcjonalny opis do debugowania
+        :param consume_on: PF-y końcowe, na których wpis jest konsumowany (pozostałe z allow_pf tylko pasują);
+                           brak → polityka domyślna poniżej
         """
         ttl = self.ttl if ttl_sec is None else float(ttl_sec)
         pf_set: Set[str] = {pf.upper() for pf in (allow_pf or [])} if allow_pf else set()
 
         # Domyślna, wstecznie kompatybilna polityka:
         # jeśli oczekujemy zarówno AGREE jak i INFORM → konsumuj wyłącznie na INFORM.
-        consume_on: Optional[Set[str]] = None
-        if {"AGREE", "INFORM"}.issubset(pf_set):
-            consume_on = {"INFORM"}
+        consume_set: Optional[Set[str]] = {pf.upper() for pf in consume_on} if consume_on else None
+        if consume_set is None and {"AGREE", "INFORM"}.issubset(pf_set):
+            consume_set = {"INFORM"}
 
+        now = time.monotonic()
+        self._purge(now)
+        expires_at = now + ttl
         bucket = self._by_conv.setdefault(conv_id, {})
         bucket[reply_with] = Expectation(
             allow_from=set(allow_from or []),
             allow_pf=pf_set,
-            expires_at=time.time() + ttl,
+            expires_at=expires_at,
             note=note,
-            consume_on=consume_on,
+            consume_on=consume_set,
         )
+        heapq.heappush(self._expiry, (expires_at, conv_id, reply_with))
 
     def match_and_pop(
         self,
@@ -98,6 +109,9 @@ class CorrBook:
         if not in_reply_to:
             return True
 
+        now = time.monotonic()
+        self._purge(now)
+
         bucket = self._by_conv.get(conv_id)
         if not bucket:
             return False
@@ -107,7 +121,6 @@ class CorrBook:
             return False
 
         # TTL
-        now = time.time()
         if now > exp.expires_at:
             bucket.pop(in_reply_to, None)
             self._cleanup_conv(conv_id)
@@ -143,17 +156,25 @@ class CorrBook:
 
     def sweep(self) -> None:
         """Usuń wszystkie wpisy, które wygasły (TTL)."""
-        now = time.time()
-        for conv_id, bucket in list(self._by_conv.items()):
-            for rid, exp in list(bucket.items()):
-                if now > exp.expires_at:
-                    bucket.pop(rid, None)
-            if not bucket:
-                self._by_conv.pop(conv_id, None)
+        self._purge(time.monotonic())
 
     # Wewnętrzne
     # ----------
 
+    def _purge(self, now: float) -> None:
+        # Zdejmuj z kopca terminy < now; wpis usuwamy tylko, jeśli to wciąż ta sama rejestracja
+        # (skonsumowane lub ponownie zarejestrowane (conv, reply_with) zostawiają w kopcu nieaktualny termin)
+        heap = self._expiry
+        while heap and heap[0][0] < now:
+            expires_at, conv_id, rid = heapq.heappop(heap)
+            bucket = self._by_conv.get(conv_id)
+            if bucket is None:
+                continue
+            exp = bucket.get(rid)
+            if exp is not None and exp.expires_at == expires_at:
+                bucket.pop(rid, None)
+                self._cleanup_conv(conv_id)
+
     def _cleanup_conv(self, conv_id: str) -> None:
         bucket = self._by_conv.get(conv_id)
         if bucket is not None and not bucket:
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Czyste helpery z gorącej ścieżki Koordynatora (wywoływane dla każdej ramki / każdego logu).
+# Pełne adnotacje typów i brak zależności od SPADE/pydantic → moduł kompiluje się mypyc:
+#   pip install mypy && mypyc firststage/protocol/fastpath.py
+# Zbudowane rozszerzenie (.so obok .py) ma pierwszeństwo przy imporcie; bez niego działa czysty Python.
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, Dict, List
+
+
+# Ramki, których Koordynator nigdy nie konsumuje (echo własnych odpowiedzi do Presentera).
+# Tolerujemy spacje stdlib json ("type": "...") i zwarty zapis orjson ("type":"...").
+_ECHO_TYPE_RE = re.compile(r'"type"\s*:\s*"PRESENTER_REPLY"')
+
+
+def is_presenter_reply(body: str) -> bool:
+    """Tani test na surowym body (bez pełnego parsowania JSON)."""
+    return "PRESENTER_REPLY" in body and _ECHO_TYPE_RE.search(body) is not None
+
+
+def looks_like_json_object(body: str) -> bool:
+    """Czy body może być obiektem JSON (ACL)? Odsiewa czat/puste ramki bez wyjątku z parsera."""
+    if not body:
+        return False
+    c = body[0]
+    if c == "{":
+        return True
+    return c in " \t\r\n" and body.lstrip()[:1] == "{"
+
+
+def dig(d: Any, *keys: str, default: Any = None) -> Any:
+    """Zagnieżdżony odczyt d[k1][k2]... bez tymczasowych "or {}"; brak klucza / nie-dict / None → default."""
+    for k in keys:
+        if not isinstance(d, dict):
+            return default
+        d = d.get(k)
+    return default if d is None else d
+
+
+def short(txt: str, n: int = 80) -> str:
+    t = (txt or "").replace("\n", " ").strip()
+    return t if len(t) <= n else (t[:n] + "…")
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def compact(txt: str, n: int) -> str:
+    """Jak short(), ale zwija każdy ciąg białych znaków do jednej spacji (mniej tokenów w prompcie)."""
+    t = _WS_RE.sub(" ", txt or "").strip()
+    return t if len(t) <= n else (t[:n] + "…")
+
+
+def _text_user_msg(c: Dict[str, Any]) -> str:
+    return str((c.get("args") or {}).get("question") or "")
+
+
+def _text_presenter_reply(c: Dict[str, Any]) -> str:
+    return str(c.get("text") or "")
+
+
+def _text_result(c: Dict[str, Any]) -> str:
+    return str((c.get("result") or {}).get("answer") or c.get("answer") or "")
+
+
+# typ treści → tekst do historii (klucze kanoniczne, UPPER)
+HISTORY_EXTRACTORS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "USER_MSG": _text_user_msg,
+    "PRESENTER_REPLY": _text_presenter_reply,
+    "RESULT": _text_result,
+}
+
+
+def history_text_from_acl(acl: Dict[str, Any]) -> str:
+    c: Dict[str, Any] = acl.get("content") or {}
+    typ = c.get("type")
+    if not typ:
+        return ""
+    # Nadawcy w MAS wysyłają typy już w UPPER – .upper() tylko gdy dokładne trafienie zawiedzie
+    f = HISTORY_EXTRACTORS.get(typ) or HISTORY_EXTRACTORS.get(str(typ).upper())
+    return f(c) if f is not None else ""
+
+
+def normalize_candidates(raw_list: List[Any], need_cap: str) -> List[Dict[str, Any]]:
+    """Kandydaci z DF (jid albo profil) → jednolite profile; wpisy bez jid odrzucamy."""
+    caps = [need_cap]  # wspólna (tylko do odczytu) lista dla kandydatów podanych samym jid
+    out: List[Dict[str, Any]] = []
+    app = out.append
+    for item in raw_list:
+        t = type(item)
+        if t is str or (t is not dict and isinstance(item, str)):
+            if item:
+                app({"jid": item, "name": item, "description": "",
+                     "capabilities": caps, "skills": [], "status": "online"})
+        elif t is dict or isinstance(item, dict):
+            get = item.get
+            jid = get("jid", "")
+            if jid:
+                app({
+                    "jid": jid,
+                    "name": get("name", jid),
+                    "description": get("description", ""),
+                    "capabilities": get("capabilities", []),
+                    "skills": get("skills", []),
+                    "status": get("status", "online"),
+                })
+    return out
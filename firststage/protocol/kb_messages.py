@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Typowane odpowiedzi KB (INFORM STORED/VALUE, FAILURE.*, REFUSE.*) dla Koordynatora.
+# Z msgspec: dekodowanie + walidacja w jednym przebiegu prosto do Struct (bez pośredniego dict).
+# Bez msgspec: ten sam kształt jako dataclass, budowany z codec.decode_body().
+from __future__ import annotations
+
+import base64
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Optional
+
+from firststage.protocol import codec
+
+try:
+    import msgspec  # type: ignore
+except Exception:
+    msgspec = None
+
+# Pola, które KB może odesłać top-level albo w content.{...}
+_KB_FIELDS = ("type", "key", "version", "etag", "content_type", "value", "stored_at", "reason")
+
+if msgspec is not None:
+    class KBReply(msgspec.Struct, kw_only=True):
+        performative: str = ""
+        ontology: str = ""
+        conversation_id: Optional[str] = None
+        type: str = ""
+        key: Optional[str] = None
+        version: Optional[int] = None
+        etag: Optional[str] = None
+        content_type: Optional[str] = None
+        value: Any = None
+        stored_at: Optional[str] = None
+        reason: Optional[str] = None
+        content: Optional[Dict[str, Any]] = None
+
+    _JSON_DEC = msgspec.json.Decoder(KBReply)
+    _MP_DEC = msgspec.msgpack.Decoder(KBReply)
+else:
+    @dataclass
+    class KBReply:  # type: ignore[no-redef]
+        performative: str = ""
+        ontology: str = ""
+        conversation_id: Optional[str] = None
+        type: str = ""
+        key: Optional[str] = None
+        version: Optional[int] = None
+        etag: Optional[str] = None
+        content_type: Optional[str] = None
+        value: Any = None
+        stored_at: Optional[str] = None
+        reason: Optional[str] = None
+        content: Optional[Dict[str, Any]] = None
+
+    _NAMES = {f.name for f in fields(KBReply)}
+
+
+def decode_kb_reply(body: codec.Body, encoding: Optional[str] = None) -> KBReply:
+    """
+    Dekoduje ramkę KB do KBReply. Pola z content.{...} uzupełniają brakujące top-level,
+    więc konsument czyta zawsze rep.type / rep.value / rep.version.
+    Błędny format → ValueError.
+    """
+    if msgspec is not None:
+        try:
+            if encoding == codec.ENC_MSGPACK_B64:
+                rep = _MP_DEC.decode(base64.b64decode(body, validate=True))
+            else:
+                rep = _JSON_DEC.decode(body)
+        except Exception as e:
+            raise ValueError(f"Niepoprawna ramka KB: {e}") from e
+    else:
+        raw = codec.decode_body(body, encoding)
+        if not isinstance(raw, dict):
+            raise ValueError("Niepoprawna ramka KB: oczekiwano obiektu")
+        try:
+            rep = KBReply(**{k: v for k, v in raw.items() if k in _NAMES})
+        except TypeError as e:
+            raise ValueError(f"Niepoprawna ramka KB: {e}") from e
+
+    if rep.content:
+        for name in _KB_FIELDS:
+            if name in rep.content and getattr(rep, name) in (None, ""):
+                setattr(rep, name, rep.content[name])
+    return rep
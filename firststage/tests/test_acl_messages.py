@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
-from firststage.protocol.acl_messages import AclMessage, make_acl, normalize_performative, VALID_PERFORMATIVES
+import re
+import time
+
+from firststage.protocol import codec
+from firststage.protocol.acl_messages import (
+    AclMessage, AclTemplate, make_acl, new_reply_id, normalize_performative, now_iso, VALID_PERFORMATIVES,
+)
 
 def test_normalize_variants():
     assert normalize_performative("request") == "REQUEST"
@@ -20,3 +26,41 @@ def test_all_performatives_accepted():
         s = make_acl(pf,"A","B",content={"ok":True})
         m = AclMessage.loads(s)
         assert m.performative == pf
+
+def test_now_iso_format_and_current_second():
+    # gmtime() bez argumentu czyta zegar zgrubny (time(NULL)) – porównujemy z tym samym źródłem co now_iso()
+    before = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time_ns() // 1_000_000_000))
+    s = now_iso()
+    after = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time_ns() // 1_000_000_000))
+    assert re.fullmatch(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ", s)
+    assert before <= s <= after
+
+def test_new_reply_id_unique_within_same_ms():
+    ids = {new_reply_id("dfq") for _ in range(1000)}
+    assert len(ids) == 1000
+    assert all(i.startswith("dfq-") for i in ids)
+
+def test_acl_template_matches_make_acl():
+    tpl = AclTemplate("QUERY-REF", "Coordinator", "Registry", content={"need": "ASK_EXPERT"}, protocol="fipa-query")
+    got = codec.loads(tpl.render(conversation_id="c1", reply_with="r1"))
+    ref = codec.loads(make_acl("QUERY-REF", "Coordinator", "Registry", content={"need": "ASK_EXPERT"},
+                               conversation_id="c1", reply_with="r1", protocol="fipa-query"))
+    got.pop("timestamp"), ref.pop("timestamp")
+    assert got == ref
+    assert codec.loads(tpl.render(content={"need": "ALL"}))["content"] == {"need": "ALL"}
+
+def test_acl_template_escapes_ids_and_keeps_field_order():
+    tpl = AclTemplate("REQUEST", "Coordinator", "Specialist")
+    body = tpl.render(conversation_id='c"1\\', reply_with=None, content={"q": "zażółć \"x\""})
+    d = codec.loads(body)
+    assert d["conversation_id"] == 'c"1\\' and d["reply_with"] is None
+    assert d["content"] == {"q": "zażółć \"x\""}
+    assert list(d) == list(codec.loads(make_acl("REQUEST", "Coordinator", "Specialist", content={})))
+
+def test_make_acl_matches_model_dump():
+    body = make_acl("request", "A", "B", content={"x": 1}, conversation_id="c", reply_with="r")
+    d = codec.loads(body)
+    ref = AclMessage(performative="REQUEST", sender="A", receiver="B", content={"x": 1},
+                     conversation_id="c", reply_with="r", timestamp=d["timestamp"]).model_dump()
+    assert list(d) == list(ref)
+    assert d == ref
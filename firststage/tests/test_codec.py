@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from firststage.protocol import codec
+
+def test_roundtrip_unicode_without_escapes():
+    s = codec.dumps({"q": "zażółć gęślą jaźń", "n": [1, 2.5, None, True]})
+    assert isinstance(s, str)
+    assert "zażółć" in s
+    assert codec.loads(s) == {"q": "zażółć gęślą jaźń", "n": [1, 2.5, None, True]}
+
+def test_loads_accepts_bytes():
+    assert codec.loads(b'{"a":1}') == {"a": 1}
+
+def test_loads_invalid_raises_value_error():
+    with pytest.raises(ValueError):
+        codec.loads("nie-json")
+
+@pytest.mark.skipif(not codec.msgpack_available(), reason="msgspec niezainstalowany")
+def test_msgpack_b64_roundtrip():
+    frame = {"type": "STORE", "key": "session:s:chat:timeline:main", "value": [{"text": "ą"}], "if_match": None}
+    body = codec.encode_body(frame, codec.ENC_MSGPACK_B64)
+    assert isinstance(body, str)
+    assert codec.decode_body(body, codec.ENC_MSGPACK_B64) == frame
+
+def test_decode_body_defaults_to_json():
+    assert codec.decode_body('{"a":1}', None) == {"a": 1}
+    assert codec.encode_body({"a": 1}) == codec.dumps({"a": 1})
+
+def test_dumpb_is_utf8_of_dumps():
+    obj = {"q": "zażółć", "n": [1, None]}
+    assert codec.dumpb(obj) == codec.dumps(obj).encode("utf-8")
+    assert codec.loads(memoryview(b"\x01" + codec.dumpb(obj))[1:]) == obj
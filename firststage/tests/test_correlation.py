@@ -13,3 +13,26 @@ def test_corr_register_and_match():
     assert corr.match_and_pop("c1","r1", from_bare="s@d", performative="INFORM")
     # drugi raz już nie przejdzie (pop)
     assert not corr.match_and_pop("c1","r1", from_bare="s@d", performative="INFORM")
+
+def test_corr_expired_entries_are_purged():
+    corr = CorrBook()
+    corr.register("c1", "old", allow_pf=["INFORM"], ttl_sec=-1)   # już wygasły
+    corr.register("c2", "live", allow_pf=["INFORM"], ttl_sec=30)
+    assert "c1" not in corr._by_conv                               # zdjęty przy kolejnym register
+    assert corr.match_and_pop("c2", "live", from_bare=None, performative="INFORM")
+    assert corr._by_conv == {}
+
+def test_corr_reregistered_entry_survives_stale_expiry():
+    corr = CorrBook()
+    corr.register("c1", "r1", ttl_sec=-1)
+    corr._by_conv["c1"]["r1"].expires_at += 60                      # jak ponowna rejestracja z nowym terminem
+    corr.sweep()
+    assert corr.match_and_pop("c1", "r1", from_bare=None, performative="INFORM")
+
+def test_corr_consume_on_keeps_entry_for_non_final_pf():
+    corr = CorrBook()
+    corr.register("c1", "r1", allow_pf=["INFORM", "REFUSE", "FAILURE"], consume_on=["inform"])
+    assert corr.match_and_pop("c1", "r1", from_bare=None, performative="REFUSE")
+    assert corr.match_and_pop("c1", "r1", from_bare=None, performative="FAILURE")
+    assert corr.match_and_pop("c1", "r1", from_bare=None, performative="INFORM")
+    assert not corr.match_and_pop("c1", "r1", from_bare=None, performative="INFORM")
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from firststage.protocol import codec
+from firststage.protocol.fastpath import (
+    compact, dig, history_text_from_acl, is_presenter_reply, looks_like_json_object, normalize_candidates, short,
+)
+
+def test_history_text_by_type():
+    assert history_text_from_acl({"content": {"type": "USER_MSG", "args": {"question": "q?"}}}) == "q?"
+    assert history_text_from_acl({"content": {"type": "presenter_reply", "text": "t"}}) == "t"
+    assert history_text_from_acl({"content": {"type": "RESULT", "result": {"answer": "a"}}}) == "a"
+    assert history_text_from_acl({"content": {"type": "HEARTBEAT"}}) == ""
+    assert history_text_from_acl({}) == ""
+
+def test_normalize_candidates_mixed():
+    out = normalize_candidates(["a@x", {"jid": "b@x", "capabilities": ["C"]}, {"name": "bez-jid"}, 7], "ASK_EXPERT")
+    assert [c["jid"] for c in out] == ["a@x", "b@x"]
+    assert out[0]["capabilities"] == ["ASK_EXPERT"]
+    assert out[1]["name"] == "b@x" and out[1]["status"] == "online"
+
+def test_short_flattens_and_truncates():
+    assert short("a\nb") == "a b"
+    assert short("x" * 10, 4) == "xxxx…"
+
+def test_presenter_reply_sniff():
+    assert is_presenter_reply(codec.dumps({"content": {"type": "PRESENTER_REPLY", "text": "x"}}))
+    assert is_presenter_reply('{"content": {"type": "PRESENTER_REPLY"}}')
+    assert not is_presenter_reply(codec.dumps({"content": {"type": "USER_MSG", "args": {"question": "PRESENTER_REPLY?"}}}))
+
+def test_compact_collapses_whitespace():
+    assert compact("  a \t\n\n b   c ", 80) == "a b c"
+    assert compact("ab   cd", 4) == "ab c…"
+
+def test_looks_like_json_object():
+    assert looks_like_json_object(codec.dumps({"a": 1}))
+    assert looks_like_json_object(' \n{"a": 1}')
+    assert not looks_like_json_object("")
+    assert not looks_like_json_object("hello")
+    assert not looks_like_json_object("[1, 2]")
+
+def test_dig_nested_and_defaults():
+    c = {"args": {"question": "q?", "empty": ""}, "meta": None}
+    assert dig(c, "args", "question", default="") == "q?"
+    assert dig(c, "args", "missing", default="") == ""
+    assert dig(c, "meta", "presenter_jid") is None
+    assert dig(c, "args", "question", "deeper", default=0) == 0
+    assert dig(c, "args", "empty", default="x") == ""
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from firststage.protocol import codec
+from firststage.protocol.kb_messages import decode_kb_reply
+
+def test_decode_top_level_value():
+    body = codec.dumps({"performative": "INFORM", "ontology": "MAS.KB", "conversation_id": "c1-kbget-1",
+                        "type": "VALUE", "key": "session:c1:chat:timeline:main", "version": 3, "value": [{"text": "a"}]})
+    rep = decode_kb_reply(body)
+    assert rep.type == "VALUE" and rep.version == 3 and rep.value == [{"text": "a"}]
+    assert rep.conversation_id == "c1-kbget-1"
+
+def test_decode_fills_from_content():
+    body = codec.dumps({"ontology": "MAS.KB", "content": {"type": "STORED", "version": 7, "etag": "e"}})
+    rep = decode_kb_reply(body)
+    assert (rep.type, rep.version, rep.etag) == ("STORED", 7, "e")
+
+def test_decode_invalid_raises_value_error():
+    with pytest.raises(ValueError):
+        decode_kb_reply("nie-json")
+
+@pytest.mark.skipif(not codec.msgpack_available(), reason="msgspec niezainstalowany")
+def test_decode_msgpack():
+    body = codec.encode_body({"ontology": "MAS.KB", "type": "FAILURE.CONFLICT", "reason": "x"}, codec.ENC_MSGPACK_B64)
+    rep = decode_kb_reply(body, codec.ENC_MSGPACK_B64)
+    assert rep.type == "FAILURE.CONFLICT" and rep.reason == "x"
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime as dt
+
+from firststage.agent.kbagent import AsyncKBStorage, StoreBatcher, _jsonb_encode
+
+class _FakeConn:
+    def __init__(self, row):
+        self.row = row
+        self.calls = []
+
+    async def fetchrow(self, sql, *args):
+        self.calls.append(args)
+        return self.row
+
+class _FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        pool = self
+
+        class _Ctx:
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+        return _Ctx()
+
+def test_astore_none_value_binds_json_null():
+    # asyncpg nie woła kodeka dla None (→ SQL NULL, value jsonb NOT NULL); ma pójść JSON null
+    conn = _FakeConn((0, 1, dt.datetime(2025, 1, 1, tzinfo=dt.timezone.utc)))
+    st = AsyncKBStorage(_FakePool(conn))
+    version, _etag, _at = asyncio.run(st.astore("k:a:b:c:d", "application/json", None, None, None, "t", None))
+    assert version == 1
+    bound = conn.calls[0][5]
+    assert bound is not None
+    assert _jsonb_encode(bound) == b"\x01null"
+
+def test_insert_none_value_binds_json_null():
+    conn = _FakeConn((3, dt.datetime(2025, 1, 1, tzinfo=dt.timezone.utc)))
+    version, _etag, _at = asyncio.run(
+        AsyncKBStorage._insert(conn, "k:a:b:c:d", "application/json", None, None, None, "t"))
+    assert version == 3
+    bound = conn.calls[0][3]
+    assert bound is not None
+    assert _jsonb_encode(bound) == b"\x01null"
+    assert _jsonb_encode({"a": 1}) == b'\x01{"a":1}'
+
+class _FakeStorage:
+    """astore_many/astore bez bazy: wersja = kolejny numer per klucz; fail_many/fail_keys wymuszają błędy."""
+    def __init__(self, fail_many=False, fail_keys=()):
+        self.fail_many = fail_many
+        self.fail_keys = set(fail_keys)
+        self.versions = {}
+        self.many_calls = []
+        self.one_calls = []
+
+    def _next(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+        return self.versions[key]
+
+    async def astore_many(self, rows):
+        self.many_calls.append([r["key"] for r in rows])
+        if self.fail_many:
+            raise RuntimeError("unique violation")
+        return {r["etag"]: (self._next(r["key"]), "at-" + r["key"]) for r in rows}
+
+    async def astore(self, key, content_type, value, tags, session_id, created_by, if_match):
+        self.one_calls.append((key, if_match))
+        if key in self.fail_keys:
+            raise RuntimeError("boom " + key)
+        return self._next(key), "etag-" + key, "at-" + key
+
+def _store(b, key, if_match=None):
+    return b.astore(key, "application/json", {"k": key}, None, None, "t", if_match)
+
+def test_batcher_fans_out_batched_results():
+    async def scenario():
+        st = _FakeStorage()
+        b = StoreBatcher(st, window_s=0.05, batch_max=8)
+        b.start()
+        res = await asyncio.gather(_store(b, "a"), _store(b, "b"), _store(b, "a"))
+        await b.aclose()
+        return st, res
+    st, res = asyncio.run(scenario())
+    assert st.many_calls == [["a", "b", "a"]]
+    assert st.one_calls == []
+    assert [(v, at) for v, _etag, at in res] == [(1, "at-a"), (1, "at-b"), (2, "at-a")]
+    assert len({etag for _v, etag, _at in res}) == 3
+
+def test_batcher_flushes_at_batch_max():
+    async def scenario():
+        st = _FakeStorage()
+        b = StoreBatcher(st, window_s=10.0, batch_max=2)  # okno dłuższe niż test: wsad domyka limit
+        b.start()
+        res = await asyncio.wait_for(asyncio.gather(_store(b, "a"), _store(b, "b")), 1.0)
+        await b.aclose()
+        return st, res
+    st, res = asyncio.run(scenario())
+    assert st.many_calls == [["a", "b"]]
+    assert [v for v, _e, _at in res] == [1, 1]
+
+def test_batcher_falls_back_per_row_on_batch_failure():
+    async def scenario():
+        st = _FakeStorage(fail_many=True, fail_keys={"bad"})
+        b = StoreBatcher(st, window_s=0.05, batch_max=8)
+        b.start()
+        res = await asyncio.gather(_store(b, "a"), _store(b, "bad"), _store(b, "c"), return_exceptions=True)
+        await b.aclose()
+        return st, res
+    st, res = asyncio.run(scenario())
+    assert st.many_calls == [["a", "bad", "c"]]
+    assert [k for k, _ in st.one_calls] == ["a", "bad", "c"]
+    assert res[0] == (1, "etag-a", "at-a")
+    assert isinstance(res[1], RuntimeError) and "bad" in str(res[1])
+    assert res[2] == (1, "etag-c", "at-c")
+
+def test_batcher_if_match_bypasses_batch():
+    async def scenario():
+        st = _FakeStorage()
+        b = StoreBatcher(st, window_s=0.05, batch_max=8)
+        b.start()
+        res = await _store(b, "a", if_match="v3")
+        queued = b.queue.qsize()
+        await b.aclose()
+        return st, res, queued
+    st, res, queued = asyncio.run(scenario())
+    assert res == (1, "etag-a", "at-a")
+    assert st.one_calls == [("a", "v3")]
+    assert st.many_calls == []
+    assert queued == 0
+
+def test_batcher_skips_cancelled_and_aclose_cancels_queued():
+    async def scenario():
+        st = _FakeStorage()
+        b = StoreBatcher(st, window_s=0.05, batch_max=8)
+        b.start()
+        gone = asyncio.ensure_future(_store(b, "gone"))
+        kept = asyncio.ensure_future(_store(b, "kept"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        assert (await kept)[0] == 1
+        # pętla zatrzymana → ramka zostaje w kolejce, aclose ją anuluje
+        b._task.cancel()
+        late = asyncio.ensure_future(_store(b, "late"))
+        await asyncio.sleep(0)
+        await b.aclose()
+        await asyncio.sleep(0)
+        return st, late
+    st, late = asyncio.run(scenario())
+    assert st.many_calls == []                  # po odsianiu anulowanego został jeden wiersz → zwykły astore
+    assert st.one_calls == [("kept", None)]
+    assert late.cancelled()
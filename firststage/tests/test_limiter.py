@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from firststage.utils.limiter import AdaptiveLimiter
+
+def test_aimd_window():
+    async def scenario():
+        lim = AdaptiveLimiter(4, min_limit=1, max_limit=5)
+        await lim.on_overload()
+        assert lim.limit == 2
+        await lim.on_overload()
+        await lim.on_overload()
+        assert lim.limit == 1
+        for _ in range(3):
+            await lim.on_ok()
+        assert lim.limit == 2
+        for _ in range(50):
+            await lim.on_ok()
+        assert lim.limit == 5
+    asyncio.run(scenario())
+
+def test_caps_in_flight_and_wakes_on_growth():
+    async def scenario():
+        lim = AdaptiveLimiter(1, max_limit=2)
+        await lim.acquire()
+        waiter = asyncio.ensure_future(lim.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await lim.on_ok()  # 1 → 2
+        await asyncio.wait_for(waiter, 1.0)
+        assert lim.in_flight == 2
+        await lim.release()
+        await lim.release()
+        assert lim.in_flight == 0
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import importlib
+import types
+
+import pytest
+from spade.message import Message
+
+from firststage.protocol import codec
+from firststage.protocol.acl_messages import AclTemplate
+from firststage.protocol.correlation import CorrBook
+
+COORD = "coordinator@xmpp.test"
+
+@pytest.fixture
+def presenter(tmp_path, monkeypatch):
+    # presenter.py wymaga pliku .env w drzewie (find_dotenv z cwd) – pusty wystarczy
+    (tmp_path / ".env").write_text("")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("COORDINATOR_JID", COORD)
+    monkeypatch.setenv("PRESENTER_RECV_TIMEOUT", "0")
+    import firststage.agent.presenter as mod
+    return importlib.reload(mod)
+
+def _frame(conv, irt, pf, content):
+    msg = Message(to="presenter@xmpp.test", sender=COORD + "/res",
+                  body=codec.dumps({"performative": pf, "sender": "Coordinator", "receiver": "Presenter",
+                                    "conversation_id": conv, "in_reply_to": irt, "content": content}))
+    msg.metadata = {"conv": conv, "performative": pf, "in_reply_to": irt}
+    return msg
+
+def test_refuse_then_inform_reaches_waiting_conversation(presenter):
+    async def scenario():
+        agent = types.SimpleNamespace(
+            coordinator_jid=COORD, coord_bare=COORD, _coord_prefix=COORD + "/",
+            corr=CorrBook(ttl_sec=30), waiting=None,
+            user_msg_tpl=AclTemplate("REQUEST", "Presenter", "Coordinator", protocol="fipa-request"),
+            user_msg_meta={"presenter_jid": "presenter@xmpp.test"},
+        )
+        conv = presenter.PresenterAgent.ServeConversation("pytanie?", "sess-1")
+        conv.agent = agent
+        sent = []
+
+        async def _send(msg):
+            sent.append(msg)
+        conv.send = _send
+        reply_id = await conv.send_user_msg()
+        fut = asyncio.get_running_loop().create_future()
+        agent.waiting = ("sess-1", fut)
+
+        disp = presenter.PresenterAgent.Dispatcher()
+        disp.agent = agent
+        disp.queue = asyncio.Queue()  # SPADE tworzy ją w set_agent() przy add_behaviour
+        disp.queue.put_nowait(_frame("sess-1", reply_id, "REFUSE", {"type": "BUSY"}))
+        await disp.run()
+        assert not fut.done()  # REFUSE nie kończy rozmowy i nie zużywa korelacji
+        disp.queue.put_nowait(_frame("sess-1", reply_id, "INFORM", {"type": "PRESENTER_REPLY", "text": "odp"}))
+        await disp.run()
+        assert fut.result() == "odp"
+        assert sent and sent[0].get_metadata("reply_with") == reply_id
+        assert agent.corr._by_conv == {}  # INFORM skonsumował wpis
+    asyncio.run(scenario())
@@ -10,10 +10,14 @@ Opcjonalnie: pip install tiktoken  (lepsze szacowanie tokenów)
 """
 
 import os
+import sys
 import json
 import time
 import math
 import asyncio
+import functools
+import logging
+from concurrent.futures import Executor
 from typing import Dict, Any, List, Optional, Literal, Tuple
 
 # --- dotenv (opcjonalnie) ---
@@ -29,7 +33,7 @@ except Exception as e:
 
 # --- OpenAI client i wyjątki ---
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
     from openai import OpenAIError
     # W nowych wersjach:
     try:
@@ -40,6 +44,21 @@ try:
 except Exception as e:
     raise RuntimeError("Brak biblioteki 'openai'. Zainstaluj: pip install openai") from e
 
+# --- klient HTTP dla AsyncOpenAI: pula połączeń keep-alive, HTTP/2 gdy jest pakiet h2 ---
+try:
+    import httpx  # zależność openai
+    try:
+        from openai import DefaultAsyncHttpxClient as _AsyncHttpClient  # domyślne timeouty/limity openai
+    except Exception:
+        _AsyncHttpClient = httpx.AsyncClient  # type: ignore
+except Exception:
+    httpx = None  # type: ignore
+try:
+    import h2  # type: ignore  # noqa: F401  (pip install h2 → HTTP/2)
+    _HTTP2 = True
+except Exception:
+    _HTTP2 = False
+
 # --- tiktoken (opcjonalnie, lepszy estymator tokenów) ---
 try:
     import tiktoken  # type: ignore
@@ -57,6 +76,24 @@ def _env(*names: str, default: Optional[str] = None) -> Optional[str]:
 def _now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
+def _setup_logging() -> logging.Logger:
+    """
+    Logger "ai" w formacie dawnych print(): "[AI] 2025-01-01T12:00:00Z ...".
+    Agent z własnym logowaniem (np. Koordynator z QueueListener) może podmienić handlery tego loggera.
+    """
+    lg = logging.getLogger("ai")
+    if not lg.handlers:
+        out = logging.StreamHandler(sys.stdout)
+        fmt = logging.Formatter("[AI] %(asctime)s %(message)s", datefmt="%Y-%m-%dT%H:%M:%SZ")
+        fmt.converter = time.gmtime
+        out.setFormatter(fmt)
+        lg.addHandler(out)
+        lg.propagate = False
+    lg.setLevel((_env("OPENAI_LOG_LEVEL", default="INFO") or "INFO").upper())
+    return lg
+
+log = _setup_logging()
+
 def _to_int(x: Optional[str]) -> Optional[int]:
     try:
         return int(x) if x not in (None, "", "0") else None
@@ -78,6 +115,9 @@ OPENAI_SEED          = _to_int(_env("OPENAI_SEED"))        # None → bez seed
 OPENAI_CTX_LIMIT     = _to_int(_env("OPENAI_CTX_LIMIT"))   # opcjonalne, nadpisze mapę
 OPENAI_RESERVE_TOKENS= _to_int(_env("OPENAI_RESERVE_TOKENS", default="1024")) or 1024
 
+OPENAI_NATIVE_ASYNC  = _env("OPENAI_NATIVE_ASYNC", default="1") not in ("0", "false", "no")  # 0 → async w wątkach
+OPENAI_MAX_CONNECTIONS = _to_int(_env("OPENAI_MAX_CONNECTIONS", default="10")) or 10
+
 RETRY_MAX_CYCLES     = _to_int(_env("OPENAI_RETRY_MAX", default="5")) or 5
 RETRY_SLEEP_SEC      = _to_float(_env("OPENAI_RETRY_SLEEP", default="2")) or 2.0
 
@@ -147,7 +187,9 @@ class AIConnector:
     API:
       - chat_one(message, caller=None, **opts)
       - chat_from_history(messages, caller=None, **opts)
-      - achat_one(...), achat_from_history(...) – warianty async (wątki)
+      - achat_one(...), achat_from_history(...) – warianty async: natywnie przez AsyncOpenAI
+        (OPENAI_NATIVE_ASYNC=0 → klient sync w wątkach)
+      - aclose() – zamyka pulę połączeń klienta async
     Zwracany wynik: dict z polami: id, model, created, finish_reason, usage, text, raw, (opcjonalnie) error.
     """
 
@@ -160,6 +202,8 @@ class AIConnector:
         default_temperature: float = OPENAI_TEMPERATURE,
         default_max_tokens: Optional[int] = OPENAI_MAX_TOKENS,
         default_seed: Optional[int] = OPENAI_SEED,
+        executor: Optional[Executor] = None,
+        max_connections: Optional[int] = None,
     ) -> None:
         self.api_key = api_key or OPENAI_API_KEY
         if not self.api_key:
@@ -170,9 +214,22 @@ class AIConnector:
         self.default_temperature = default_temperature
         self.default_max_tokens = default_max_tokens
         self.default_seed = default_seed
+        # Pula wątków dla wariantów async (None → domyślna pula pętli, min(32, cpu+4) wątków)
+        self.executor = executor
 
         self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
-        print(f"[AI] {_now_iso()} Konektor gotowy. model={self.default_model}")
+        # Klient async z własną pulą keep-alive (bez wątku i nowego handshake na każde wywołanie)
+        self.aclient: Optional[AsyncOpenAI] = None
+        if OPENAI_NATIVE_ASYNC:
+            http_client = None
+            if httpx is not None:
+                n = max(1, max_connections or OPENAI_MAX_CONNECTIONS)
+                http_client = _AsyncHttpClient(
+                    http2=_HTTP2,
+                    limits=httpx.Limits(max_keepalive_connections=n, max_connections=2 * n),
+                )
+            self.aclient = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+        log.info("Konektor gotowy. model=%s", self.default_model)
 
     # ---------- Publiczne (sync) ----------
     def chat_one(
@@ -221,25 +278,41 @@ class AIConnector:
 
     # ---------- Publiczne (async – równoległe użycie) ----------
     async def achat_one(self, message: Dict[str, Any], **kw) -> Dict[str, Any]:
-        """Asynchroniczny wariant chat_one – wykonywany w wątku, nie blokuje event loop."""
-        return await asyncio.to_thread(self.chat_one, message, **kw)
+        """Asynchroniczny wariant chat_one – nie blokuje event loop."""
+        if self.aclient is None:
+            return await self._in_thread(self.chat_one, message, **kw)
+        self._validate_message(message)
+        return await self._achat([message], **kw)
 
     async def achat_from_history(self, messages: List[Dict[str, Any]], **kw) -> Dict[str, Any]:
-        """Asynchroniczny wariant chat_from_history – wykonywany w wątku, nie blokuje event loop."""
-        return await asyncio.to_thread(self.chat_from_history, messages, **kw)
+        """Asynchroniczny wariant chat_from_history – nie blokuje event loop."""
+        if self.aclient is None:
+            return await self._in_thread(self.chat_from_history, messages, **kw)
+        self._validate_messages(messages)
+        return await self._achat(messages, **kw)
+
+    async def aclose(self) -> None:
+        if self.aclient is not None:
+            await self.aclient.close()
+
+    async def _in_thread(self, fn, *args, **kw) -> Dict[str, Any]:
+        if self.executor is None:
+            return await asyncio.to_thread(fn, *args, **kw)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kw))
 
     # ---------- Prywatne ----------
-    def _chat(
+    def _prepare(
         self,
         messages: List[Dict[str, Any]],
-        *,
         caller: Optional[str],
         model: Optional[str],
         temperature: Optional[float],
         max_tokens: Optional[int],
         seed: Optional[int],
         extra: Optional[Dict[str, Any]],
-    ) -> Dict[str, Any]:
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """Payload dla chat.completions.create albo gotowy wynik błędu (kontekst za duży)."""
         mdl = model or self.default_model
         payload: Dict[str, Any] = {
             "model": mdl,
@@ -261,8 +334,8 @@ class AIConnector:
         if est_tokens > limit_for_input:
             ts = _now_iso()
             agent = caller or "unknown"
-            print(f"[AI] {ts} KONTEKST ZA DUŻY: est={est_tokens} > limit_in={limit_for_input} (model={mdl}) agent={agent}")
-            return {
+            log.warning("KONTEKST ZA DUŻY: est=%s > limit_in=%s (model=%s) agent=%s", est_tokens, limit_for_input, mdl, agent)
+            return payload, {
                 "id": None,
                 "model": mdl,
                 "created": int(time.time()),
@@ -283,64 +356,54 @@ class AIConnector:
                 "raw": None,
             }
 
-        # --- wywołanie OpenAI z retry na 429 ---
-        print(f"[AI] {_now_iso()} → chat.completions.create model={mdl} msgs={len(messages)} est_in={est_tokens}")
-        attempt = 0
-        last_err: Optional[Exception] = None
-        while attempt < RETRY_MAX_CYCLES:
-            attempt += 1
-            try:
-                resp = self.client.chat.completions.create(**payload)
-                # OK
-                choice = resp.choices[0]
-                text = ""
-                try:
-                    text = getattr(choice.message, "content", None) or ""
-                except Exception:
-                    text = ""
-
-                result: Dict[str, Any] = {
-                    "id": getattr(resp, "id", None),
-                    "model": getattr(resp, "model", None),
-                    "created": getattr(resp, "created", None),
-                    "finish_reason": getattr(choice, "finish_reason", None),
-                    "usage": (getattr(resp, "usage", None).model_dump()  # type: ignore[attr-defined]
-                              if getattr(resp, "usage", None) else None),
-                    "text": text,
-                    "raw": (resp.model_dump() if hasattr(resp, "model_dump") else json.loads(resp.json())),
-                }
-                print(f"[AI] {_now_iso()} ← OK finish_reason={result['finish_reason']}")
-                return result
-
-            except RateLimitError as e:
-                # Klasyczny 429
-                last_err = e
-                print(f"[AI] {_now_iso()} 429 RateLimit (próba {attempt}/{RETRY_MAX_CYCLES}) – śpię {RETRY_SLEEP_SEC}s")
-                time.sleep(RETRY_SLEEP_SEC)
-                continue
-            except APIStatusError as e:  # typ HTTP z kodem statusu
-                last_err = e
-                status = getattr(e, "status_code", None)
-                if status == 429:
-                    print(f"[AI] {_now_iso()} 429 APIStatus (próba {attempt}/{RETRY_MAX_CYCLES}) – śpię {RETRY_SLEEP_SEC}s")
-                    time.sleep(RETRY_SLEEP_SEC)
-                    continue
-                print(f"[AI] {_now_iso()} Błąd HTTP {status}: {e}")
-                raise
-            except OpenAIError as e:
-                # Inne błędy biblioteki – nie retry'ujemy w nieskończoność
-                last_err = e
-                print(f"[AI] {_now_iso()} Błąd OpenAI: {e}")
-                raise
-            except Exception as e:
-                last_err = e
-                print(f"[AI] {_now_iso()} Nieoczekiwany błąd: {e}")
-                raise
+        log.info("→ chat.completions.create model=%s msgs=%s est_in=%s", mdl, len(messages), est_tokens)
+        return payload, None
+
+    @staticmethod
+    def _result(resp: Any) -> Dict[str, Any]:
+        choice = resp.choices[0]
+        text = ""
+        try:
+            text = getattr(choice.message, "content", None) or ""
+        except Exception:
+            text = ""
+
+        result: Dict[str, Any] = {
+            "id": getattr(resp, "id", None),
+            "model": getattr(resp, "model", None),
+            "created": getattr(resp, "created", None),
+            "finish_reason": getattr(choice, "finish_reason", None),
+            "usage": (getattr(resp, "usage", None).model_dump()  # type: ignore[attr-defined]
+                      if getattr(resp, "usage", None) else None),
+            "text": text,
+            "raw": (resp.model_dump() if hasattr(resp, "model_dump") else json.loads(resp.json())),
+        }
+        log.info("← OK finish_reason=%s", result["finish_reason"])
+        return result
+
+    @staticmethod
+    def _is_rate_limit(e: Exception) -> bool:
+        return isinstance(e, RateLimitError) or (
+            isinstance(e, APIStatusError) and getattr(e, "status_code", None) == 429)
+
+    @staticmethod
+    def _log_failure(e: Exception, attempt: int) -> None:
+        if AIConnector._is_rate_limit(e):
+            log.warning("429 (próba %s/%s) – śpię %ss", attempt, RETRY_MAX_CYCLES, RETRY_SLEEP_SEC)
+        elif isinstance(e, APIStatusError):  # typ HTTP z kodem statusu
+            log.warning("Błąd HTTP %s: %s", getattr(e, "status_code", None), e)
+        elif isinstance(e, OpenAIError):
+            # Inne błędy biblioteki – nie retry'ujemy w nieskończoność
+            log.warning("Błąd OpenAI: %s", e)
+        else:
+            log.warning("Nieoczekiwany błąd: %s", e)
 
+    @staticmethod
+    def _rate_limited(mdl: str, caller: Optional[str], last_err: Optional[Exception]) -> Dict[str, Any]:
         # Po wyczerpaniu prób 429
         ts = _now_iso()
         agent = caller or "unknown"
-        print(f"[AI] {ts} Nieudane po {RETRY_MAX_CYCLES} próbach (429). Agent={agent}")
+        log.warning("Nieudane po %s próbach (429). Agent=%s", RETRY_MAX_CYCLES, agent)
         return {
             "id": None,
             "model": mdl,
@@ -362,6 +425,66 @@ class AIConnector:
             "raw": None,
         }
 
+    def _chat(
+        self,
+        messages: List[Dict[str, Any]],
+        *,
+        caller: Optional[str],
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        seed: Optional[int],
+        extra: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        payload, early = self._prepare(messages, caller, model, temperature, max_tokens, seed, extra)
+        if early is not None:
+            return early
+
+        # --- wywołanie OpenAI z retry na 429 ---
+        attempt = 0
+        last_err: Optional[Exception] = None
+        while attempt < RETRY_MAX_CYCLES:
+            attempt += 1
+            try:
+                return self._result(self.client.chat.completions.create(**payload))
+            except Exception as e:
+                last_err = e
+                self._log_failure(e, attempt)
+                if not self._is_rate_limit(e):
+                    raise
+                time.sleep(RETRY_SLEEP_SEC)
+        return self._rate_limited(payload["model"], caller, last_err)
+
+    async def _achat(
+        self,
+        messages: List[Dict[str, Any]],
+        *,
+        caller: Optional[str] = None,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        seed: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Jak _chat, ale natywnie async (AsyncOpenAI) – przerwa po 429 nie blokuje pętli."""
+        payload, early = self._prepare(messages, caller, model, temperature, max_tokens, seed, extra)
+        if early is not None:
+            return early
+
+        attempt = 0
+        last_err: Optional[Exception] = None
+        while attempt < RETRY_MAX_CYCLES:
+            attempt += 1
+            try:
+                return self._result(await self.aclient.chat.completions.create(**payload))  # type: ignore[union-attr]
+            except Exception as e:
+                last_err = e
+                self._log_failure(e, attempt)
+                if not self._is_rate_limit(e):
+                    raise
+                await asyncio.sleep(RETRY_SLEEP_SEC)
+        return self._rate_limited(payload["model"], caller, last_err)
+
     # ---------------- walidacja ---------------
     @staticmethod
     def _validate_message(msg: Dict[str, Any]) -> None:
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Adaptacyjny limit współbieżności (AIMD, jak okno TCP) zamiast statycznego asyncio.Semaphore.
+# Semafora nie da się bezpiecznie „przestawić” w locie (wewnętrzny licznik), więc: Condition + własny licznik.
+from __future__ import annotations
+
+import asyncio
+from typing import Optional
+
+
+class AdaptiveLimiter:
+    """
+    async with limiter: ...  – zajmuje slot, gdy in_flight < limit.
+    on_ok()       – sukces u odbiorcy: okno rośnie addytywnie (+1 na pełne okno sukcesów),
+    on_overload() – przeciążenie (429 / timeout): okno maleje o połowę (nie poniżej min_limit).
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: Optional[int] = None):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit or initial)
+        self._cwnd = float(min(max(initial, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._cwnd)
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify(1)
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.release()
+
+    async def on_ok(self) -> None:
+        before = self.limit
+        self._cwnd = min(float(self.max_limit), self._cwnd + 1.0 / self._cwnd)
+        if self.limit > before:
+            async with self._cond:
+                self._cond.notify_all()  # okno urosło – wpuść czekających
+
+    async def on_overload(self) -> None:
+        self._cwnd = max(float(self.min_limit), self._cwnd / 2.0)